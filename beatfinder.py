@@ -1,11 +1,16 @@
 import numpy as np
 import pyaudio
-from collections import deque
-from aubio import tempo
+from threading import Thread, Event
+from time import perf_counter, time
 
 
 #local
 import osc_client
+from instrumentation import Instrumentation
+from metering import LevelMeter
+from ensemble import create_tempo
+from stabiliser import BpmStabiliser
+from phase import BeatScheduler
 
 
 
@@ -20,55 +25,263 @@ class BeatPrinter:
         self.state = (self.state + 1) % len(self.spinner)
 
 
+class RingBuffer:
+    """Preallocated single-producer / single-consumer float32 ring buffer.\n
+    The audio callback is the only writer and the analysis worker the only reader,
+    each side only advances its own position counter, so no lock is needed.
+    """
+
+    def __init__(self, capacity: int):
+        # round up to a power of two so wrapping is a cheap bitmask
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self._data = np.zeros(size, dtype=np.float32)
+        self._mask = size - 1
+        self._write = 0  # total frames written, only advanced by the producer
+        self._read = 0  # total frames read, only advanced by the consumer
+
+    @property
+    def capacity(self) -> int:
+        return self._data.size
+
+    @property
+    def written(self) -> int:
+        """Total number of frames written since creation"""
+        return self._write
+
+    def available(self) -> int:
+        """Number of frames waiting to be read"""
+        return self._write - self._read
+
+    def write(self, frames: np.ndarray) -> bool:
+        """Copy frames into the buffer (producer side)\n
+        Args:
+            frames (np.ndarray): float32 samples
+        Returns:
+            bool: False if there was not enough room, nothing is written then
+        """
+        n = frames.size
+        if n > self.capacity - (self._write - self._read):
+            return False
+
+        start = self._write & self._mask
+        end = start + n
+        if end <= self.capacity:
+            self._data[start:end] = frames
+        else:
+            split = self.capacity - start
+            self._data[start:] = frames[:split]
+            self._data[:n - split] = frames[split:]
+
+        # publish only after the copy is complete
+        self._write += n
+        return True
+
+    def read_into(self, out: np.ndarray) -> bool:
+        """Fill out with the next out.size frames (consumer side)\n
+        Args:
+            out (np.ndarray): preallocated float32 array
+        Returns:
+            bool: False if not enough frames are available, out is untouched then
+        """
+        n = out.size
+        if self._write - self._read < n:
+            return False
+
+        start = self._read & self._mask
+        end = start + n
+        if end <= self.capacity:
+            out[:] = self._data[start:end]
+        else:
+            split = self.capacity - start
+            out[:split] = self._data[start:]
+            out[split:] = self._data[:n - split]
+
+        self._read += n
+        return True
+
+
+class BlockAdapter:
+    """Turns driver buffers of any size into exact hop sized blocks for aubio\n
+    push() is called from the audio callback, pull() from the analysis worker.
+    Every accepted driver buffer also stores a time anchor, so any analysed frame
+    can be mapped back to the stream time it was captured at.
+    """
+
+    def __init__(self, hop_size: int, samplerate: int, capacity: int):
+        self.hop_size = hop_size
+        self.samplerate = samplerate
+        self.ring = RingBuffer(capacity)
+        self.hop = np.zeros(hop_size, dtype=np.float32)  # reused for every pull
+        self.position = 0  # frame index of the first sample in self.hop
+        self._pulled = 0  # frames handed to the consumer so far
+        self._anchor = (0, 0.0)  # (frame index, stream time), replaced as a whole
+        self.clock_offset = 0.0  # stream time minus perf_counter(), refreshed by the callback
+
+    def push(self, frames: np.ndarray, adc_time: float) -> bool:
+        """Store a driver buffer (producer side)\n
+        Args:
+            frames (np.ndarray): float32 samples of any length
+            adc_time (float): stream time the first frame was captured at
+        Returns:
+            bool: False if the frames had to be dropped
+        """
+        first = self.ring.written
+        if not self.ring.write(frames):
+            return False
+        self._anchor = (first, adc_time)
+        return True
+
+    def pull(self):
+        """Next hop sized block (consumer side)\n
+        Returns:
+            np.ndarray | None: the preallocated hop array or None if not enough frames are buffered
+        """
+        if not self.ring.read_into(self.hop):
+            return None
+        self.position = self._pulled
+        self._pulled += self.hop_size
+        return self.hop
+
+    def now(self) -> float:
+        """Current stream time, derived from perf_counter() so it is cheap to call from any thread"""
+        return perf_counter() + self.clock_offset
+
+    def frame_time(self, frame: int) -> float:
+        """Stream time of an analysed frame, accurate to the sample\n
+        Args:
+            frame (int): frame index counted from the start of the stream (e.g. aubio tempo.get_last())
+        Returns:
+            float: stream time in seconds
+        """
+        anchor_frame, anchor_time = self._anchor
+        return anchor_time + (frame - anchor_frame) / self.samplerate
+
+
+class CallbackStats:
+    """Counters written by the audio callback, read by anyone"""
+
+    def __init__(self):
+        self.callbacks: int = 0
+        self.overflows: int = 0  # input overflows reported by PortAudio
+        self.dropped_frames: int = 0  # frames lost because the ring buffer was full
+        self.time_total: float = 0.0  # seconds spent inside the callback
+        self.time_max: float = 0.0
+
+    def record(self, duration: float) -> None:
+        self.callbacks += 1
+        self.time_total += duration
+        if duration > self.time_max:
+            self.time_max = duration
+
+    def __str__(self) -> str:
+        avg = self.time_total / self.callbacks if self.callbacks else 0.0
+        return (f"callbacks: {self.callbacks}, overflows: {self.overflows}, "
+                f"dropped frames: {self.dropped_frames}, "
+                f"callback time avg: {avg * 1e6:.1f}us max: {self.time_max * 1e6:.1f}us")
+
+
+def default_samplerate(device_index: int = None) -> int:
+    """Default sample rate of an input device\n
+    Args:
+        device_index (int, optional): pyaudio device index, None for the default input device
+    Returns:
+        int: rate in Hz, None if the device cannot be queried
+    """
+    audio = pyaudio.PyAudio()
+    try:
+        if device_index is None:
+            info = audio.get_default_input_device_info()
+        else:
+            info = audio.get_device_info_by_index(device_index)
+        return int(info['defaultSampleRate'])
+    except (OSError, ValueError):
+        return None
+    finally:
+        audio.terminate()
+
+
 class BeatDetector:
 
-    def __init__(self, client: osc_client.OSCclient, audio_device_index: int = 1, parent=None, buf_size: int = 128):
+    def __init__(self, client: osc_client.OSCclient, audio_device_index: int = 1, parent=None, buf_size: int = 128,
+                 frames_per_buffer: int = None, samplerate: int = 44100, win_size: int = None,
+                 onset_method: str = "default", ensemble: str = "", timing: Instrumentation = None,
+                 stabiliser: BpmStabiliser = None, lead: float = None, resync_on_downbeat: bool = False,
+                 beat_address: str = None, open_stream: bool = True):
         # arguments
         self.client = client  # OSC client
         self.audio_device_index = audio_device_index
         self.parent = parent  # MainFrame
-        self.buf_size: int = buf_size  # buffer size
+        self.buf_size: int = buf_size  # aubio hop size
+        self.frames_per_buffer: int = frames_per_buffer or buf_size  # driver buffer size, independent of the hop
         
         # variables
         self.blink = 0  # blinking state flag
         self.bpm = 128
-        self.beat_counter = 0 # for live beat divider
-        self.SAMPLERATE: int = 44100
+        self.SAMPLERATE: int = samplerate
+        self.win_size: int = win_size or buf_size * 2  # aubio window size
+        self.onset_method: str = onset_method
         self.level_reset = None  # Timer for resetting level
-        self.level_queue = deque(maxlen=20)  # RMS Level queue
-        self.p: pyaudio.PyAudio = pyaudio.PyAudio()
-        self.tempo = tempo("default", self.buf_size * 2, self.buf_size, self.SAMPLERATE)            
+        self.meter = LevelMeter(self.buf_size, self.SAMPLERATE)  # RMS / peak level, read by the PeakMeter
+        # without a stream, beats are only fed by calling _on_beat, e.g. from a benchmark
+        self.p: pyaudio.PyAudio = pyaudio.PyAudio() if open_stream else None
+        # aubio tempo, or an EnsembleTempo fusing extra onset methods
+        self.tempo = create_tempo(self.onset_method, self.win_size, self.buf_size, self.SAMPLERATE, ensemble)
 
-        # Callback to GUI
-        if self.parent is not None:
-            self.stream: pyaudio.Stream = self.p.open(
-                format=pyaudio.paFloat32,
-                channels=1,
-                rate=self.SAMPLERATE,
-                input=True,
-                input_device_index=self.audio_device_index,
-                frames_per_buffer=self.buf_size,
-                stream_callback=self._GUI_callback
-            )
+        # capture path: the callback only fills the ring buffer, the worker analyses it
+        self.stats = CallbackStats()
+        # ~0.5s of headroom for a stalled worker, but always room for a few driver buffers
+        self.adapter = BlockAdapter(self.buf_size, self.SAMPLERATE,
+                                    max(self.SAMPLERATE // 2, self.frames_per_buffer * 4))
+        self.last_beat_time = None  # stream time of the last detected beat
+        self.timing = timing or Instrumentation()  # per stage latency histograms, disabled by default
+        self.stabiliser = stabiliser or BpmStabiliser()  # filters jitter and gates OSC sends
 
-        # Callback to Console (standalone)
-        else:
-            self.stream: pyaudio.Stream = self.p.open(
+        # with a lead time, OSC is sent ahead of the predicted beat instead of after the detection
+        self.resync_on_downbeat = resync_on_downbeat
+        # with a beat address every beat goes out as one bundle stamped with the predicted beat time
+        self.beat_address = beat_address
+        self._scheduled_bpm = None  # value the scheduler sends at the next predicted beat
+        self.scheduler = BeatScheduler(self._scheduled_send, lead) if lead is not None else None
+        if self.scheduler is not None and parent is not None:
+            # the bar is counted in detected beats until both tempos meet on a downbeat again
+            self.scheduler.beats_per_bar = parent.rate.cycle
+        self._data_ready = Event()
+        self._active = True
+        self._closed = False
+
+        # output class when running without GUI
+        if self.parent is None:
+            self.spinner = BeatPrinter()
+
+        self.worker: Thread = None
+        self.stream: pyaudio.Stream = None
+        if not open_stream:
+            return
+        try:
+            self.stream = self.p.open(
                 format=pyaudio.paFloat32,
                 channels=1,
                 rate=self.SAMPLERATE,
                 input=True,
-                frames_per_buffer=self.buf_size,
-                stream_callback=self._STANDALONE_callback
+                input_device_index=self.audio_device_index if self.parent is not None else None,
+                frames_per_buffer=self.frames_per_buffer,
+                stream_callback=self._audio_callback
             )
-            # init output class
-            self.spinner = BeatPrinter()
+        except Exception:
+            # e.g. an unsupported rate, do not leave the scheduler and pyaudio behind
+            self.close()
+            raise
 
+        # started once there is a stream, the callback buffers whatever arrives before
+        self.worker = Thread(target=self._analysis_worker, name="BeatDetector-analysis", daemon=True)
+        self.worker.start()
 
-    def _GUI_callback(self, in_data, frame_count, time_info, status):
+    def _audio_callback(self, in_data, frame_count, time_info, status):
         """Callback for pyaudio stream\n
-        Calculates BPM and sends them to the GUI\n
-        Calculates RMS Level into variable self.level to fetch by PeakMeter\n
+        Only copies the frames into the ring buffer and wakes the analysis worker,
+        everything else happens in _analysis_worker.\n
         Args:
             in_data (array): data from pyaudio stream
             frame_count (int): number of frames in in_data
@@ -77,97 +290,221 @@ class BeatDetector:
         Returns:
             None, paContinue: Tells pyaudio to continue streaming
         """
+        start = perf_counter()
+        self.adapter.clock_offset = time_info['current_time'] - start
 
-        signal = np.frombuffer(in_data, dtype=np.float32)
-        beat = self.tempo(signal)
+        if status & pyaudio.paInputOverflow:
+            self.stats.overflows += 1
 
-        # Calculate RMS Level for every frame and add it to a circular buffer
-        self.level_queue.append(int(np.sqrt(signal.dot(signal)/signal.size) * 200))  # 9,0ms
-        """alternative RMS functions:
-        # cur = np.sqrt((signal*signal).sum()/(1.*len(signal)))*10000 #10,1ms
-        #self.level = np.sqrt(signal.dot(signal)/signal.size) * 10000  # 9,0ms
-        # cur = np.sqrt(np.mean(np.square(signal))) * 10000 #23,5ms
-        # cur = np.max(np.abs(signal))*10000 #12,0ms"""
-        
-        # if beat is detected
-        if beat[0]:
-            
-            self.beat_counter += 1
-            # extract bpm
-            self.bpm = round(self.tempo.get_bpm())
-
-            if self.bpm > 20 and self.bpm < 200 and self.parent.running:
-                if self.parent.sync:
-
-                    # SEND to osc and BOTH display if sync is on
-                    
-                    self.parent.send_bpm = self.bpm
-                                        
-                    self.parent.update_bpm_display(self.bpm, send_to="live", Blink=True)
-                    
-                    if self.parent.beat_divider == 1:
-                        self.client.send_osc(self.parent.config['OSC']['BPM_ADRESS'], self.bpm, map_to_resolume=True)
-                        
-                        self.parent.update_bpm_display(self.bpm, send_to="send", Blink=True) # send bpm to send display
-                        
-                        self.parent.next_led()
-
-                    
-                    elif (self.beat_counter + 1) % self.parent.beat_divider == 0:
-                        self.client.send_osc(self.parent.config['OSC']['BPM_ADRESS'], self.bpm // self.parent.beat_divider, map_to_resolume=True)
-                        
-                        self.parent.update_bpm_display(self.bpm // self.parent.beat_divider, send_to="send", Blink=True) # send bpm to send display
-                        
-                        self.parent.next_led()
-
-                        
-                    # BLINK resync button to beat when syncing (tap thread taking over when no sync)
-                    #self.parent.button_resync.BackgroundColour = (220, 220, 220) if self.blink else self.parent.bg_grey
-                    #self.blink = not self.blink
-                    
-
-                else:
-                    # SEND only to LIVE display if sync is off
-                    self.parent.update_bpm_display(self.bpm, send_to="live", Blink=False)
-                    
-            if self.beat_counter == 4:
-                self.beat_counter = 0
+        # some host APIs do not report an ADC time
+        adc_time = time_info['input_buffer_adc_time'] or time_info['current_time']
+        frames = np.frombuffer(in_data, dtype=np.float32)
+        if self.timing.enabled:
+            self.timing.record('frombuffer', perf_counter() - start)
+        if not self.adapter.push(frames, adc_time):
+            self.stats.dropped_frames += frame_count
+
+        self._data_ready.set()
+        self.stats.record(perf_counter() - start)
 
         # terminate stream if running is stopped
-        return (None, pyaudio.paContinue) if self.parent.running else (None, pyaudio.paComplete)
+        return (None, pyaudio.paContinue) if self._active else (None, pyaudio.paComplete)
+
+    def _analysis_worker(self):
+        """Persistent worker thread, drains the block adapter in hop sized blocks"""
+        while self._active:
+            self._data_ready.wait(0.5)
+            # clear before draining, so data written meanwhile wakes us up again
+            self._data_ready.clear()
+            hop = self.adapter.pull()
+            while hop is not None:
+                self._process_hop(hop)
+                hop = self.adapter.pull()
+
+    def _process_hop(self, signal: np.ndarray):
+        """Calculates BPM and sends them to OSC and the GUI\n
+        Meters RMS and peak level into self.meter to fetch by PeakMeter\n
+        Args:
+            signal (np.ndarray): one hop of float32 samples
+        """
+        timing = self.timing.enabled
+        if timing:
+            t0 = perf_counter()
+            # how long the last sample of this hop waited for the analysis
+            self.timing.record('input', self.adapter.now() - self.adapter.frame_time(self.adapter.position + signal.size))
 
-    def _STANDALONE_callback(self, in_data, frame_count, time_info, status):
-        signal = np.frombuffer(in_data, dtype=np.float32)
         beat = self.tempo(signal)
+
+        if timing:
+            t1 = perf_counter()
+            self.timing.record('tempo', t1 - t0)
+
+        # Calculate RMS and peak level for every hop into the meter history
+        self.meter.update(signal)
+        if timing:
+            self.timing.record('rms', perf_counter() - t1)
+
+        # if beat is detected
         if beat[0]:
-            self.spinner.print_bpm(self.tempo.get_bpm())
-        return None, pyaudio.paContinue  # Tell pyAudio to continue
+            self.last_beat_time = self.adapter.frame_time(self.tempo.get_last())
+            if self.parent is None:
+                self.spinner.print_bpm(self.tempo.get_bpm())
+            else:
+                self._on_beat()
+
+    def _on_beat(self):
+        """Dispatches a detected beat to OSC and the GUI"""
+        # extract bpm, stabilised over the recent beat intervals
+        self.bpm = self.stabiliser.update(self.last_beat_time, self.tempo.get_bpm())
+
+        if self.scheduler is not None:
+            # the scheduler works in perf_counter time
+            self.scheduler.beat(self.last_beat_time - self.adapter.clock_offset, self.tempo.get_bpm())
+
+        if self.bpm > 20 and self.bpm < 200 and self.parent.running:
+            self.parent.live_bpm = self.bpm
+            if self.parent.sync:
+
+                # SEND to osc and BOTH display if sync is on
+                
+                self.parent.send_bpm = self.bpm
+                                    
+                self.parent.update_bpm_display(self.bpm, send_to="live", Blink=True)
+                
+                # sent beats due on this detected beat, below a ratio of 1 some carry none
+                self.parent.follow_rate(self.bpm)
+                beats = self.parent.rate.gate()
+                if beats:
+                    self._send_bpm(self.parent.rate.apply(self.bpm), beats)
+
+                # BLINK resync button to beat when syncing (tap thread taking over when no sync)
+                #self.parent.button_resync.BackgroundColour = (220, 220, 220) if self.blink else self.parent.bg_grey
+                #self.blink = not self.blink
+                
+
+            else:
+                # SEND only to LIVE display if sync is off
+                self.parent.update_bpm_display(self.bpm, send_to="live", Blink=False)
+
+    def _send_bpm(self, bpm: float, beats: int = 1):
+        """Sends the bpm to the send display and the beat LEDs\n
+        OSC only goes out if the value changed since the last send
+
+        Args:
+            bpm (float): tempo at the rate ratio
+            beats (int): sent beats since the last call, the LEDs advance as many
+        """
+        timing = self.timing.enabled
+
+        if self.scheduler is not None:
+            # sent by _scheduled_send ahead of the next beat
+            self._scheduled_bpm = bpm
+        elif self.stabiliser.should_send(bpm):
+            if timing:
+                t0 = perf_counter()
+
+            self.client.send_osc(self.parent.config['OSC']['BPM_ADRESS'], bpm, map_to_resolume=True)
+
+            if timing:
+                self._record_send(t0)
+
+        if timing:
+            t1 = perf_counter()
+
+        self.parent.update_bpm_display(bpm, send_to="send", Blink=True) # send bpm to send display
+        for _ in range(beats):
+            self.parent.next_led(thread=False)  # already off the audio thread
+
+        if timing:
+            self.timing.record('gui', perf_counter() - t1)
+
+    def _scheduled_send(self, beat_in_bar: int, beat_time: float):
+        """Called by the scheduler a lead time before each predicted beat\n
+        Args:
+            beat_in_bar (int): detected beat in the rate ratio's cycle, 0 is a downbeat of the sent tempo
+            beat_time (float): perf_counter() time of the predicted beat
+        """
+        if not (self.parent.running and self.parent.sync) or self._scheduled_bpm is None:
+            return
+
+        if self.beat_address is not None:
+            self._send_beat_bundle(beat_in_bar, beat_time)
+            return
+
+        if self.stabiliser.should_send(self._scheduled_bpm):
+            if self.timing.enabled:
+                t0 = perf_counter()
+            self.client.send_osc(self.parent.config['OSC']['BPM_ADRESS'], self._scheduled_bpm, map_to_resolume=True)
+            if self.timing.enabled:
+                self._record_send(t0)
+
+        if self.resync_on_downbeat and beat_in_bar == 0:
+            self.client.send_osc(self.parent.config['OSC']['RESYNC_BAR_ADRESS'], 1)
+
+    def _send_beat_bundle(self, beat_in_bar: int, beat_time: float):
+        """Tempo, beat position and bar resync in one bundle timetagged with the beat"""
+        config = self.parent.config['OSC']
+        messages = []
+        output_beat = self.parent.rate.output_beat(beat_in_bar)
+        if output_beat is not None:
+            # position in the sent bar, only on detected beats a sent beat lands on
+            messages.append((self.beat_address, output_beat, False))
+        if self.stabiliser.should_send(self._scheduled_bpm):
+            messages.insert(0, (config['BPM_ADRESS'], self._scheduled_bpm, True))
+        if self.resync_on_downbeat and beat_in_bar == 0:
+            messages.append((config['RESYNC_BAR_ADRESS'], 1, False))
+        if not messages:
+            return
+
+        if self.timing.enabled:
+            t0 = perf_counter()
+        # the timetag is wall clock time, the prediction perf_counter time
+        self.client.send_bundle(messages, beat_time + time() - perf_counter())
+        if self.timing.enabled:
+            self._record_send(t0)
+
+    def _record_send(self, t0: float):
+        """Timing of a tempo send that started at perf_counter() time t0"""
+        self.timing.record('send_osc', perf_counter() - t0)
+        # time from the last detected beat in the audio until the tempo left the machine,
+        # with the scheduler the send waits for the next predicted beat minus the lead
+        self.timing.record('beat_to_osc', self.adapter.now() - self.last_beat_time)
+
+    def rate_changed(self):
+        """The parent's rate ratio changed, count the scheduler's bar in the new cycle from the closest beat"""
+        if self.scheduler is not None:
+            self.scheduler.beats_per_bar = self.parent.rate.cycle
+            self.scheduler.resync_bar()
 
     def resync_bar(self):
         """Send resync command to Resolume"""
+        if self.scheduler is not None:
+            self.scheduler.resync_bar()
         self.client.send_osc(self.parent.config['OSC']['RESYNC_BAR_ADRESS'], 1)
 
-    def __del__(self):
-        """Close pyaudio stream and terminate pyaudio
+    def close(self):
+        """Stop the analysis worker, close pyaudio stream and terminate pyaudio
         """
+        if self._closed:
+            return
+        self._closed = True
+        self._active = False
+        self._data_ready.set()
+        if self.worker is not None:
+            self.worker.join()
+        if self.scheduler is not None:
+            self.scheduler.close()
         if self.level_reset is not None:
             self.level_reset.cancel()
-        self.stream.close()
-        self.p.terminate()
+        if self.stream is not None:
+            self.stream.close()
+        if self.p is not None:
+            self.p.terminate()
 
-if __name__ == "__main__":
-    import os
-    import time
+    def __del__(self):
+        self.close()
 
-    client = osc_client.OSCclient("127.0.0.1", 7000)
-    bd = BeatDetector(client, verbose=True, buf_size=128)
-    try:
-        # Audio processing happens in separate thread, so put this thread to sleep
-        if os.name == 'nt':  # Windows is not able to pause the main thread :(
-            while True:
-                time.sleep(1)
-        else:
-            signal.pause()
-    except:
-        # print(sum(bd.timings)/len(bd.timings))
-        pass
+if __name__ == "__main__":
+    # standalone use goes through the headless service
+    import headless
+    headless.main()
@@ -0,0 +1,113 @@
+"""Multi-digit seven segment display for the BPM values
+
+BpmDisplay draws all digits of a value on one panel. SetDisplay takes the
+whole value and the blink phase in one call, compares them with what is
+shown and refreshes only the area of the digits that changed, with a single
+Refresh call; nothing is refreshed when nothing changed. The paint handler
+blits the changed digits' cached glyphs into the persistent buffer and
+puts the buffer on screen in one pass.
+"""
+import wx
+
+from sevensegment import SevenSegmentDisp
+
+
+class BpmDisplay(SevenSegmentDisp):
+    """Seven segment display of several digits, painted in one buffered pass"""
+
+    def __init__(self, parent, digits: int = 3, pad: str = "0"):
+        """
+        Args:
+            parent (wx.Window): parent window
+            digits (int): number of digits, a longer value shows its last digits
+            pad (str): fills the digits in front of a shorter value
+        """
+        SevenSegmentDisp.__init__(self, parent)
+        self.digits = digits
+        self.pad = pad
+        self.cells = [(" ", False, False)] * digits  # glyph elements per digit
+        self.phase = 0
+        self.blink_colours = ({}, {})  # SetColours arguments per blink phase
+        self._painted = None  # (scheme, elements) per digit in the buffer, None to draw everything
+
+        self.refreshes = 0  # SetDisplay calls that changed something
+
+    def GetCellSize(self):
+        size = self.GetClientSize()
+        return wx.Size(max(1, size.width // self.digits), size.height)
+
+    def InvalidateGlyphs(self):
+        SevenSegmentDisp.InvalidateGlyphs(self)
+        # new buffer or new geometry
+        self._painted = None
+
+    def SetBlinkColours(self, even: dict, odd: dict):
+        """Colours of the two blink phases, as SetColours keyword arguments"""
+        self.blink_colours = (even, odd)
+        self.UpdateColours(**(odd if self.phase else even))
+        self._painted = None
+        self.Refresh()
+
+    def FormatValue(self, value) -> str:
+        """Text of a value, a fractional bpm gets as many decimals as there are digits left"""
+        if isinstance(value, str):
+            return value
+        whole = str(int(value))
+        if value == int(value) or len(whole) >= self.digits:
+            return str(round(value))
+        return f"{value:.{self.digits - len(whole)}f}"
+
+    def SplitCells(self, value: str) -> list:
+        """Glyph elements per digit, a "." or ":" goes with the digit before it"""
+        cells = []
+        for char in value.upper():
+            if char in ".:" and cells:
+                char_, dot, colon = cells[-1]
+                cells[-1] = (char_, dot or char == ".", colon or char == ":")
+            else:
+                cells.append((char, False, False))
+        cells = cells[-self.digits:]
+        return [(self.pad, False, False)] * (self.digits - len(cells)) + cells
+
+    def SetDisplay(self, value, phase: int = 0) -> bool:
+        """Show value with the colours of a blink phase\n
+        Args:
+            value (int | float | str): value to show
+            phase (int): blink phase, 0 or 1
+        Returns:
+            bool: True if the display has to be repainted
+        """
+        cells = self.SplitCells(self.FormatValue(value))
+        dirty = [i for i in range(self.digits) if cells[i] != self.cells[i]]
+        self.cells = cells
+        if phase != self.phase:
+            # new background everywhere
+            self.phase = phase
+            self.UpdateColours(**self.blink_colours[phase])
+            self._painted = None
+            self.refreshes += 1
+            self.Refresh(eraseBackground=False)
+            return True
+        if not dirty:
+            return False
+
+        width = self.GetCellSize().width
+        rect = wx.Rect(dirty[0] * width, 0, (dirty[-1] - dirty[0] + 1) * width, self.GetClientSize().height)
+        self.refreshes += 1
+        self.RefreshRect(rect, eraseBackground=False)
+        return True
+
+    def OnPaint(self, evt):
+        dc = wx.BufferedPaintDC(self, self._buffer)
+        if self._painted is None:
+            # also the strip right of the last digit
+            dc.SetBackground(wx.Brush(self.colours.background))
+            dc.Clear()
+            self._painted = [None] * self.digits
+
+        scheme = self.GetScheme()
+        width = self.GetCellSize().width
+        for i, cell in enumerate(self.cells):
+            if self._painted[i] != (scheme, cell):
+                dc.DrawBitmap(self.GetGlyph(cell), i * width, 0)
+                self._painted[i] = (scheme, cell)
@@ -0,0 +1,110 @@
+"""Incoming OSC remote control
+
+OSCControlServer listens on its own thread and calls the session logic
+directly, without going through the wx event queue. Addresses (with the
+configured prefix, default /bpmtoosc):
+
+    /tap                tap tempo, timed by the packet arrival
+    /resync             resync bar
+    /sync [0|1]         switch sync off / on, toggles without argument
+    /plus, /minus       send bpm +1 / -1
+    /double, /half      send bpm x2 / /2
+
+Button style messages with a 0 argument (button released) are ignored, and
+so is everything while the stream is stopped, like the disabled buttons.
+"""
+import socket
+from threading import Thread
+from time import perf_counter
+
+from pythonosc.osc_packet import OscPacket, ParseError
+
+
+class OSCControlServer:
+    """UDP server thread with an address dispatch table"""
+
+    def __init__(self, bpm_session, ip: str = "0.0.0.0", port: int = 7001, prefix: str = "/bpmtoosc"):
+        """
+        Args:
+            bpm_session (session.BpmSession): session the commands act on
+            ip (str): interface to listen on
+            port (int): UDP port to listen on
+            prefix (str): common start of the control addresses
+        """
+        self.session = bpm_session
+        prefix = prefix.rstrip("/")
+        self.sync_address = prefix + "/sync"  # the only address where 0 is a command
+        # address -> handler(arguments, arrival time)
+        self.dispatch = {
+            prefix + "/tap": lambda args, arrival: bpm_session.tap(arrival),
+            prefix + "/resync": lambda args, arrival: bpm_session.resync_bar(),
+            self.sync_address: self._sync,
+            prefix + "/plus": lambda args, arrival: bpm_session.nudge(1),
+            prefix + "/minus": lambda args, arrival: bpm_session.nudge(-1),
+            prefix + "/double": lambda args, arrival: bpm_session.scale_send_bpm(2),
+            prefix + "/half": lambda args, arrival: bpm_session.scale_send_bpm(0.5),
+        }
+        self.received = 0
+        self.unknown = 0  # packets that did not parse or had no handler
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((ip, port))
+        self.sock.settimeout(0.5)  # to notice close()
+        self._active = True
+        self._thread = Thread(target=self._run, name="OSCControlServer", daemon=True)
+        self._thread.start()
+
+    @property
+    def address(self) -> tuple:
+        return self.sock.getsockname()
+
+    def _sync(self, args, arrival):
+        self.session.switch_sync(bool(args[0]) if args else not self.session.sync)
+
+    def _run(self):
+        while self._active:
+            try:
+                dgram = self.sock.recv(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            # taken before parsing, so the tap time does not depend on anything after the socket
+            arrival = perf_counter()
+            self.received += 1
+            try:
+                messages = [timed.message for timed in OscPacket(dgram).messages]
+            except ParseError:
+                self.unknown += 1
+                continue
+            for message in messages:
+                self.handle(message.address, message.params, arrival)
+
+    def handle(self, address: str, args: list, arrival: float):
+        """Run the handler of address\n
+        Args:
+            address (str): OSC address
+            args (list): OSC arguments
+            arrival (float): perf_counter() time the packet arrived
+        """
+        handler = self.dispatch.get(address)
+        if handler is None:
+            self.unknown += 1
+            return
+        if args and not args[0] and address != self.sync_address:
+            # button released
+            return
+        if not self.session.running:
+            # like the buttons, which are disabled while the stream is stopped
+            return
+        try:
+            handler(args, arrival)
+        except Exception as e:
+            # a bad command must not kill the server
+            print(f"OSC control {address} failed: {e}")
+
+    def close(self):
+        self._active = False
+        self._thread.join()
+        self.sock.close()
@@ -0,0 +1,61 @@
+"""Waiting for absolute deadlines
+
+TempoClock, BeatScheduler and MidiClock all fire on absolute deadlines from
+a persistent thread: wait on an Event until shortly before the deadline
+(so changes can wake them early), busy wait the rest because Event.wait is
+too coarse on some OSes, and after a stall continue on the grid instead of
+catching up. The busy wait time is set once for all of them, spin_ms in the
+[SCHEDULER] section of lastsession.ini; it costs CPU and only helps with a
+core to spare, on a single core the OS scheduler dominates the jitter.
+"""
+import math
+from threading import Event
+from time import perf_counter, sleep
+
+SPIN = 0.002  # seconds busy waited before a deadline
+
+
+def set_spin(seconds: float):
+    """Busy wait time of every scheduler that does not pass its own"""
+    global SPIN
+    SPIN = max(0.0, seconds)
+
+
+def clearing_wait(event: Event):
+    """wait(timeout) for wait_until on an Event: clears it, then waits until it is set again"""
+    def wait(timeout: float) -> bool:
+        event.clear()
+        return event.wait(timeout)
+    return wait
+
+
+def wait_until(deadline: float, wait, spin: float = None, clock=perf_counter) -> bool:
+    """Wait for a deadline\n
+    Args:
+        deadline (float): clock() time to wait for
+        wait (callable): wait(timeout) -> True if woken early, e.g. clearing_wait(event)
+        spin (float, optional): seconds to busy wait before the deadline, default SPIN
+        clock (callable): monotonic time in seconds
+    Returns:
+        bool: True at the deadline, False if woken early (the deadline may have changed)
+    """
+    remaining = deadline - clock() - (SPIN if spin is None else spin)
+    if remaining > 0 and wait(remaining):
+        return False
+    while clock() < deadline:
+        sleep(0)
+    return True
+
+
+def missed(late: float, period: float, limit: float = None) -> int:
+    """Periods to skip after a stall, so the grid goes on instead of bursting the missed ones\n
+    Args:
+        late (float): seconds the deadline was missed by
+        period (float): seconds between deadlines
+        limit (float, optional): lateness still caught up normally, default one period
+    Returns:
+        int: whole periods missed, 0 up to the limit
+    """
+    if late <= (period if limit is None else limit):
+        return 0
+    return math.floor(late / period)
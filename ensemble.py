@@ -0,0 +1,152 @@
+"""Ensemble tempo tracking
+
+Runs several aubio onset methods on the same hop and fuses their BPM
+estimates by confidence weighted voting over octave related hypotheses,
+which keeps a single method from locking onto half or double time.
+EnsembleTempo has the same interface as aubio.tempo, so BeatDetector can use
+either one.
+"""
+from time import perf_counter, thread_time
+
+from aubio import tempo
+
+from instrumentation import LatencyHistogram
+
+
+def create_tempo(method: str, win_size: int, hop_size: int, samplerate: int, ensemble: str = ""):
+    """aubio tempo tracker or, if ensemble lists onset methods, an EnsembleTempo\n
+    Args:
+        method (str): onset method of the primary tracker
+        win_size (int): window size
+        hop_size (int): hop size
+        samplerate (int): sample rate
+        ensemble (str): comma separated additional onset methods, e.g. "hfc,complex"
+    """
+    extra = [m.strip() for m in ensemble.split(",") if m.strip()]
+    if not extra:
+        return tempo(method, win_size, hop_size, samplerate)
+    return EnsembleTempo([method] + extra, win_size, hop_size, samplerate)
+
+
+class _Tracker:
+    """One aubio tempo tracker and its CPU bookkeeping"""
+
+    def __init__(self, method: str, win_size: int, hop_size: int, samplerate: int):
+        self.method = method
+        self.tempo = tempo(method, win_size, hop_size, samplerate)
+        self.cpu = 0.0  # thread CPU seconds spent in aubio
+        self.calls = 0
+
+    def step(self, signal):
+        start = thread_time()
+        beat = self.tempo(signal)
+        self.cpu += thread_time() - start
+        self.calls += 1
+        return beat
+
+
+class EnsembleTempo:
+    """Several aubio tempo trackers with fused BPM\n
+    Beats are reported by the first (primary) tracker, get_bpm() returns the fused
+    estimate of all of them.
+    """
+
+    TOLERANCE = 0.03  # relative difference at which two estimates count as the same tempo
+    OCTAVE_WEIGHT = 0.5  # vote of an estimate for half / double its tempo
+    PREFERRED = (90.0, 180.0)  # tie breaker, most dance music lives here
+    MIN_BPM, MAX_BPM = 20.0, 500.0
+
+    def __init__(self, methods: list, win_size: int, hop_size: int, samplerate: int):
+        """
+        Args:
+            methods (list): aubio onset methods, the first one is the primary tracker
+            win_size (int): window size
+            hop_size (int): hop size
+            samplerate (int): sample rate
+        """
+        self.trackers = [_Tracker(m, win_size, hop_size, samplerate) for m in methods]
+        self.hop_time = hop_size / samplerate  # real time budget per call
+        self.latency = LatencyHistogram()  # call until decision, all trackers and fusion
+        self._bpm = 0.0
+        self._confidence = 0.0
+        self._fused = True
+
+    def __call__(self, signal):
+        start = perf_counter()
+        beat = self.trackers[0].step(signal)
+        for t in self.trackers[1:]:
+            t.step(signal)
+
+        self._fused = False
+        if beat[0]:
+            self._fuse()
+        self.latency.record(perf_counter() - start)
+        return beat
+
+    def _fuse(self):
+        """Confidence weighted vote over every estimate and its half / double tempo"""
+        estimates = [(t.tempo.get_bpm(), t.tempo.get_confidence()) for t in self.trackers]
+        estimates = [(bpm, max(conf, 1e-3)) for bpm, conf in estimates if bpm > 0]
+        self._fused = True
+        if not estimates:
+            return
+
+        def close(a, b):
+            return abs(a - b) <= self.TOLERANCE * b
+
+        best, best_score = None, -1.0
+        total = sum(conf for _, conf in estimates)
+        for bpm, _ in estimates:
+            for hypothesis in (bpm / 2, bpm, bpm * 2):
+                if not self.MIN_BPM <= hypothesis <= self.MAX_BPM:
+                    continue
+                score = 0.0
+                for other, conf in estimates:
+                    if close(other, hypothesis):
+                        score += conf
+                    elif close(other, hypothesis * 2) or close(other, hypothesis / 2):
+                        score += conf * self.OCTAVE_WEIGHT
+                if self.PREFERRED[0] <= hypothesis < self.PREFERRED[1]:
+                    score += 0.1 * total
+                if score > best_score:
+                    best, best_score = hypothesis, score
+
+        # refine with the weighted mean of the estimates agreeing with the winner, octave corrected
+        weight = value = 0.0
+        for other, conf in estimates:
+            for factor in (1.0, 0.5, 2.0):
+                if close(other * factor, best):
+                    weight += conf
+                    value += conf * other * factor
+                    break
+        self._bpm = value / weight
+        self._confidence = min(1.0, best_score / total)
+
+    def get_bpm(self) -> float:
+        if not self._fused:
+            self._fuse()
+        return self._bpm
+
+    def get_confidence(self) -> float:
+        if not self._fused:
+            self._fuse()
+        return self._confidence
+
+    def get_last(self) -> int:
+        return self.trackers[0].tempo.get_last()
+
+    def get_last_s(self) -> float:
+        return self.trackers[0].tempo.get_last_s()
+
+    def report(self) -> str:
+        """CPU cost per tracker and decision latency against the hop budget"""
+        lines = []
+        for t in self.trackers:
+            per_call = t.cpu / t.calls if t.calls else 0.0
+            lines.append(f"{t.method:10s} {per_call * 1e6:8.1f}us CPU per hop "
+                         f"({per_call / self.hop_time * 100:.1f}% of real time)")
+        p99 = self.latency.percentile(99)
+        lines.append(f"decision latency p50 {self.latency.percentile(50) * 1e6:.0f}us "
+                     f"p99 {p99 * 1e6:.0f}us, budget {self.hop_time * 1e6:.0f}us per hop"
+                     f"{'' if p99 <= self.hop_time else ' EXCEEDED'}")
+        return "\n".join(lines)
@@ -0,0 +1,273 @@
+"""Closed loop tempo feedback from the receiving software
+
+Resolume (and most OSC capable software) can echo its tempo parameter.
+TempoFeedback sits in front of the OSC client, remembers the tempo we want
+the receiver to have and listens for the echo. As long as the echoed tempo
+matches nothing extra is sent; a mismatch, or no confirmation within a
+timeout after a send (packet loss), makes it resend the intended tempo. If
+a few resends in a row stay unconfirmed the echo is probably not coming at
+all (OSC output off, wrong port), so the watchdog gives up until the next
+send instead of resending for the rest of the session.
+
+Usage:
+    python feedback.py      # self check against a local echoing stand-in receiver
+"""
+import socket
+from threading import Thread, Lock
+from time import perf_counter
+
+from pythonosc.osc_packet import OscPacket, ParseError
+
+from osc_client import ClientWrapper
+
+
+class TempoFeedback(ClientWrapper):
+    """Wraps an OSC client and resends the tempo when the receiver disagrees"""
+
+    def __init__(self, client, bpm_address: str, ip: str = "0.0.0.0", port: int = 7002,
+                 feedback_address: str = None, mapping: str = "resolume", tolerance: float = 0.5,
+                 timeout: float = 0.5, retries: int = 3):
+        """
+        Args:
+            client (OSCclient | OSCFanout | AsyncOSCTransport): sends the tempo
+            bpm_address (str): OSC address the tempo is sent to
+            ip (str): interface to listen for the echo on
+            port (int): UDP port to listen for the echo on
+            feedback_address (str, optional): address of the echoed tempo, default bpm_address
+            mapping (str): "resolume" if the echo is 0..1 for 20..500 BPM, "bpm" for plain BPM
+            tolerance (float): BPM difference still counted as a match
+            timeout (float): seconds without confirmation after which a send counts as lost
+            retries (int): unconfirmed resends after which the watchdog waits for the next send
+        """
+        self.client = client
+        self.bpm_address = bpm_address
+        self.feedback_address = feedback_address or bpm_address
+        self.mapping = mapping
+        self.tolerance = tolerance
+        self.timeout = timeout
+        self.retries = retries
+
+        self.intended = None  # tempo we want the receiver to have
+        self.reported = None  # last tempo echoed by the receiver
+        self._sent_at = None  # perf_counter() of the last unconfirmed tempo send, None when confirmed
+        self._retries = 0  # watchdog resends since the last send
+        self._warned = False  # "no echo" printed since the last echo
+        self._lock = Lock()
+
+        self.echoes = 0
+        self.skipped = 0  # sends left out because the receiver already had the tempo
+        self.resent = 0  # resends after a mismatch or a lost send
+        self.unconfirmed = 0  # sends the watchdog gave up on
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((ip, port))
+        self.sock.settimeout(timeout / 2)  # also the watchdog interval
+        self._active = True
+        self._thread = Thread(target=self._run, name="TempoFeedback", daemon=True)
+        self._thread.start()
+
+    @property
+    def address(self) -> tuple:
+        return self.sock.getsockname()
+
+    def _matches(self, bpm) -> bool:
+        return self.reported is not None and abs(self.reported - bpm) <= self.tolerance
+
+    def send_osc(self, osc_address: str, value, map_to_resolume=False) -> None:
+        if osc_address == self.bpm_address and map_to_resolume:
+            with self._lock:
+                self.intended = value
+                if self._matches(value):
+                    self.skipped += 1
+                    self._sent_at = None
+                    return
+                self._sent_at = perf_counter()
+                self._retries = 0
+        self.client.send_osc(osc_address, value, map_to_resolume=map_to_resolume)
+
+    def send_bundle(self, messages: list, timetag: float = None) -> None:
+        for osc_address, value, map_to_resolume in messages:
+            if osc_address == self.bpm_address and map_to_resolume:
+                with self._lock:
+                    self.intended = value
+                    self._sent_at = perf_counter()
+                    self._retries = 0
+        self.client.send_bundle(messages, timetag)
+
+    def _resend(self):
+        self.resent += 1
+        self._sent_at = perf_counter()
+        self.client.send_osc(self.bpm_address, self.intended, map_to_resolume=True)
+
+    def _watchdog(self):
+        if self._retries < self.retries:
+            # no confirmation, the send or its echo got lost
+            self._retries += 1
+            self._resend()
+            return
+        # nothing echoes, wait for the next send
+        self._sent_at = None
+        self.unconfirmed += 1
+        if not self._warned:
+            self._warned = True
+            print(f"No tempo echo on {self.feedback_address} after {self.retries} resends, "
+                  f"check the receiver's OSC output and port {self.address[1]}")
+
+    def _run(self):
+        while self._active:
+            try:
+                dgram = self.sock.recv(4096)
+            except socket.timeout:
+                with self._lock:
+                    if self._sent_at is not None and perf_counter() - self._sent_at > self.timeout:
+                        self._watchdog()
+                continue
+            except OSError:
+                break
+            try:
+                messages = [timed.message for timed in OscPacket(dgram).messages]
+            except ParseError:
+                continue
+            for message in messages:
+                if message.address == self.feedback_address and message.params:
+                    self.echo(message.params[0])
+
+    def echo(self, value: float):
+        """Tempo value reported by the receiver (any thread)"""
+        bpm = 20 + float(value) * 480 if self.mapping == "resolume" else float(value)
+        with self._lock:
+            self.echoes += 1
+            self.reported = bpm
+            self._warned = False
+            if self.intended is None:
+                return
+            if self._matches(self.intended):
+                self._sent_at = None
+            elif self._sent_at is None or perf_counter() - self._sent_at > self.timeout:
+                # someone else changed the tempo, or our send went missing. Within the
+                # timeout the echo may still be the old value on its way to ours
+                self._resend()
+
+    def stats(self) -> str:
+        client = self.client.stats() if hasattr(self.client, 'stats') else ""
+        return (f"{client}; feedback echoes {self.echoes}, reported {self.reported}, "
+                f"skipped {self.skipped}, resent {self.resent}, unconfirmed {self.unconfirmed}")
+
+    def close(self):
+        self._active = False
+        self._thread.join()
+        self.sock.close()
+        if hasattr(self.client, 'close'):
+            self.client.close()
+
+
+class EchoReceiver:
+    """Local stand-in for the receiving software\n
+    Takes the Resolume tempo messages, keeps the value and echoes it back like
+    Resolume does when the tempo changes. drop lets every n-th message get lost.
+    """
+
+    def __init__(self, echo_to: tuple, address: str = "/composition/tempocontroller/tempo", drop: int = 0):
+        self.echo_to = echo_to
+        self.address = address
+        self.drop = drop
+        self.value = None
+        self.received = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+        self._active = True
+        self._thread = Thread(target=self._run, name="EchoReceiver", daemon=True)
+        self._thread.start()
+
+    @property
+    def port(self) -> int:
+        return self.sock.getsockname()[1]
+
+    def _run(self):
+        while self._active:
+            try:
+                dgram = self.sock.recv(4096)
+            except socket.timeout:
+                continue
+            self.received += 1
+            if self.drop and self.received % self.drop == 0:
+                continue
+            for timed in OscPacket(dgram).messages:
+                if timed.message.address == self.address and timed.message.params[0] != self.value:
+                    self.value = timed.message.params[0]
+                    self.set(self.value)
+
+    def set(self, value: float):
+        """Change the tempo like a user in the receiving software would, echoes it"""
+        from osc_client import DatagramCache
+
+        self.value = value
+        self.sock.sendto(DatagramCache(1).get(self.address, float(value)), self.echo_to)
+
+    def close(self):
+        self._active = False
+        self._thread.join()
+        self.sock.close()
+
+
+def loopback_check() -> dict:
+    """Self check against an EchoReceiver\n
+    Sends a steady tempo, loses a send, and lets the receiver change its tempo.
+    Returns:
+        dict: sends that reached the receiver and feedback counters per phase
+    """
+    from time import sleep
+    from osc_client import OSCclient
+
+    address = "/composition/tempocontroller/tempo"
+    result = {}
+    feedback = None
+    receiver = None
+    try:
+        feedback = TempoFeedback(None, address, "127.0.0.1", 0, timeout=0.2)
+        receiver = EchoReceiver(("127.0.0.1", feedback.address[1]))
+        feedback.client = OSCclient("127.0.0.1", receiver.port)
+
+        # steady state: repeated sends of the confirmed tempo stay on this machine
+        feedback.send_osc(address, 128, map_to_resolume=True)
+        sleep(0.1)
+        for _ in range(100):
+            feedback.send_osc(address, 128, map_to_resolume=True)
+        result["steady"] = {"received": receiver.received, "skipped": feedback.skipped, "resent": feedback.resent}
+        assert receiver.received == 1 and feedback.skipped == 100
+
+        # the next send gets lost, the watchdog resends it
+        receiver.drop = receiver.received + 1
+        feedback.send_osc(address, 130, map_to_resolume=True)
+        sleep(0.6)
+        result["lost"] = {"received": receiver.received, "resent": feedback.resent, "reported": feedback.reported}
+        assert feedback.resent >= 1 and abs(feedback.reported - 130) < 0.01
+
+        # somebody changes the tempo in the receiver, ours gets restored
+        receiver.drop = 0
+        receiver.set((100 - 20) / 480)
+        sleep(0.3)
+        result["changed"] = {"received": receiver.received, "resent": feedback.resent, "reported": feedback.reported}
+        assert abs(feedback.reported - 130) < 0.01
+
+        # nothing echoes any more: a few resends, then the watchdog waits for the next send
+        receiver.drop = 1
+        resent = feedback.resent
+        feedback.send_osc(address, 132, map_to_resolume=True)
+        sleep(0.2 * (feedback.retries + 4))
+        result["no_echo"] = {"received": receiver.received, "resent": feedback.resent - resent,
+                             "unconfirmed": feedback.unconfirmed}
+        assert feedback.resent - resent == feedback.retries and feedback.unconfirmed == 1
+    finally:
+        if receiver is not None:
+            receiver.close()
+        if feedback is not None:
+            feedback.close()
+    return result
+
+
+if __name__ == "__main__":
+    for phase, numbers in loopback_check().items():
+        print(f"{phase:8s} {numbers}")
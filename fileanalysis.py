@@ -0,0 +1,206 @@
+"""Offline beat analysis of audio files
+
+Streams a WAV (memory-mapped) or FLAC file through the same aubio tempo
+tracker BeatDetector uses and produces a beat / BPM timeline, much faster
+than real time.
+
+Usage:
+    python fileanalysis.py set.wav -o set.csv
+"""
+import argparse
+import struct
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+from aubio import tempo
+
+
+# one row per detected beat
+BEAT_DTYPE = np.dtype([("time", np.float64), ("bpm", np.float32), ("confidence", np.float32)])
+
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_FLOAT = 3
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class BeatTimeline:
+    """Result of an offline analysis"""
+
+    def __init__(self, beats: np.ndarray, samplerate: int, duration: float, elapsed: float):
+        self.beats = beats  # structured array of BEAT_DTYPE
+        self.samplerate = samplerate
+        self.duration = duration  # seconds of audio analysed
+        self.elapsed = elapsed  # seconds of wall clock time needed
+
+    @property
+    def realtime_factor(self) -> float:
+        """How many times faster than real time the analysis ran"""
+        return self.duration / self.elapsed if self.elapsed > 0 else float("inf")
+
+    def to_csv(self, path) -> None:
+        np.savetxt(path, self.beats, fmt=("%.6f", "%.2f", "%.4f"), delimiter=",",
+                   header="time,bpm,confidence", comments="")
+
+    def save(self, path) -> None:
+        """Write the timeline as .npy or, for any other suffix, as CSV"""
+        if Path(path).suffix.lower() == ".npy":
+            np.save(path, self.beats)
+        else:
+            self.to_csv(path)
+
+
+def open_wav(path) -> tuple:
+    """Memory-map the sample data of a WAV file\n
+    Args:
+        path (str | Path): WAV file
+    Returns:
+        (np.memmap, int, float): frames x channels (x3 bytes for 24 bit), samplerate and scale to [-1, 1]
+    """
+    with open(path, "rb") as f:
+        riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError(f"{path} is not a RIFF/WAVE file")
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                raw = f.read(chunk_size)
+                audio_format, channels, samplerate, _, _, bits = struct.unpack("<HHIIHH", raw[:16])
+                if audio_format == _WAVE_FORMAT_EXTENSIBLE:
+                    audio_format = struct.unpack("<H", raw[24:26])[0]
+                fmt = (audio_format, channels, samplerate, bits)
+            elif chunk_id == b"data":
+                offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size, 1)
+            # chunks are word aligned
+            if chunk_size % 2:
+                f.seek(1, 1)
+
+    if fmt is None:
+        raise ValueError(f"{path} has no fmt chunk")
+    audio_format, channels, samplerate, bits = fmt
+
+    if audio_format == _WAVE_FORMAT_FLOAT and bits in (32, 64):
+        dtype, scale, width = np.dtype(f"<f{bits // 8}"), 1.0, 1
+    elif audio_format == _WAVE_FORMAT_PCM and bits == 8:
+        dtype, scale, width = np.dtype("u1"), 1 / 128, 1
+    elif audio_format == _WAVE_FORMAT_PCM and bits in (16, 32):
+        dtype, scale, width = np.dtype(f"<i{bits // 8}"), 1 / 2 ** (bits - 1), 1
+    elif audio_format == _WAVE_FORMAT_PCM and bits == 24:
+        dtype, scale, width = np.dtype("u1"), 1 / 2 ** 23, 3
+    else:
+        raise ValueError(f"Unsupported WAV format {audio_format} with {bits} bits")
+
+    frame_bytes = channels * dtype.itemsize * width
+    # trailing chunks (LIST, id3, cue) are not audio, a truncated file ends before chunk_size
+    frames = min(chunk_size, Path(path).stat().st_size - offset) // frame_bytes
+    shape = (frames, channels, 3) if width == 3 else (frames, channels)
+    data = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+    return data, samplerate, scale
+
+
+def _wav_chunks(path, chunk_frames: int):
+    """Yield (float32 mono chunk, samplerate) from a memory-mapped WAV file"""
+    data, samplerate, scale = open_wav(path)
+    for start in range(0, data.shape[0], chunk_frames):
+        block = data[start:start + chunk_frames]
+        if block.ndim == 3:
+            # little endian 24 bit: assemble into int32 and sign extend
+            block = (block[..., 0].astype(np.int32) | (block[..., 1].astype(np.int32) << 8)
+                     | (block[..., 2].astype(np.int32) << 16))
+            block = (block << 8) >> 8
+        elif block.dtype == np.uint8:
+            block = block.astype(np.int16) - 128
+        mono = block.mean(axis=1, dtype=np.float32)
+        if scale != 1.0:
+            mono *= scale
+        yield mono, samplerate
+
+
+def _soundfile_chunks(path, chunk_frames: int):
+    """Yield (float32 mono chunk, samplerate) from any format libsndfile can read (FLAC, ...)"""
+    try:
+        import soundfile
+    except ImportError:
+        raise ImportError("Reading non-WAV files needs the optional 'soundfile' package") from None
+
+    with soundfile.SoundFile(str(path)) as f:
+        for block in f.blocks(blocksize=chunk_frames, dtype="float32", always_2d=True):
+            yield block.mean(axis=1, dtype=np.float32), f.samplerate
+
+
+def analyse_file(path, hop_size: int = 128, win_size: int = None, method: str = "default",
+                 chunk_hops: int = 256) -> BeatTimeline:
+    """Run the beat tracker over a whole file\n
+    Args:
+        path (str | Path): WAV or FLAC file
+        hop_size (int): aubio hop size in frames, same default as BeatDetector
+        win_size (int, optional): aubio window size, defaults to 2 * hop_size
+        method (str): aubio onset method
+        chunk_hops (int): hops converted to float32 mono in one go
+    Returns:
+        BeatTimeline: detected beats and timing information
+    """
+    path = Path(path)
+    win_size = win_size or hop_size * 2
+    chunks = _wav_chunks if path.suffix.lower() in (".wav", ".wave") else _soundfile_chunks
+
+    tracker = None
+    samplerate = 0
+    beats = []
+    frames = 0
+    rest = np.zeros(0, dtype=np.float32)
+
+    start = perf_counter()
+    for mono, samplerate in chunks(path, hop_size * chunk_hops):
+        if tracker is None:
+            tracker = tempo(method, win_size, hop_size, samplerate)
+        if rest.size:
+            mono = np.concatenate((rest, mono))
+
+        usable = mono.size - mono.size % hop_size
+        for pos in range(0, usable, hop_size):
+            if tracker(mono[pos:pos + hop_size])[0]:
+                beats.append((tracker.get_last_s(), tracker.get_bpm(), tracker.get_confidence()))
+        frames += usable
+        rest = mono[usable:]
+    elapsed = perf_counter() - start
+
+    if tracker is None:
+        raise ValueError(f"{path} contains no audio")
+
+    return BeatTimeline(np.array(beats, dtype=BEAT_DTYPE), samplerate, frames / samplerate, elapsed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline beat / BPM analysis of WAV and FLAC files")
+    parser.add_argument("file", help="audio file to analyse")
+    parser.add_argument("-o", "--output", help="write the timeline to .csv or .npy")
+    parser.add_argument("--hop", type=int, default=128, help="hop size in frames (default: 128)")
+    parser.add_argument("--win", type=int, default=None, help="window size in frames (default: 2 * hop)")
+    parser.add_argument("--method", default="default", help="aubio onset method (default: default)")
+    args = parser.parse_args(argv)
+
+    timeline = analyse_file(args.file, hop_size=args.hop, win_size=args.win, method=args.method)
+
+    if args.output:
+        timeline.save(args.output)
+    else:
+        for t, bpm, _ in timeline.beats:
+            print(f"{t:10.3f}\t{bpm:.1f} BPM")
+
+    median = np.median(timeline.beats["bpm"]) if timeline.beats.size else 0.0
+    print(f"{timeline.beats.size} beats, median {median:.1f} BPM, "
+          f"{timeline.duration:.1f}s of audio in {timeline.elapsed:.2f}s "
+          f"({timeline.realtime_factor:.1f}x real time)")
+
+
+if __name__ == "__main__":
+    main()
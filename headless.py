@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Headless BPMtoOSC service for machines without a display
+
+Reads the same lastsession.ini as the GUI and sends OSC exactly like it
+(sync, rate ratio, resync), but never imports wx. Audio and OSC modules
+are loaded only after the arguments are parsed, so it starts quickly and
+is well suited to run under systemd.
+
+Optional [HEADLESS] section in lastsession.ini:
+    sync = yes              # send the live bpm, no = keep sending send_bpm
+    send_bpm = 128          # bpm sent when sync is off
+    rate = 1                # sent beats per detected beat: 1/4, 1/2, 2/3, 3/2, 2, 4, ...
+                            # (beat_divider = 2 of older versions still means 1/2)
+    resync_on_start = yes   # send a bar resync once the stream runs
+
+OSC remote control ([CONTROL] section) works the same as in the GUI.
+
+Signals (where the OS has them):
+    SIGTERM / SIGINT    stop
+    SIGUSR1             resync bar
+    SIGUSR2             print the latency histograms
+    SIGHUP              re-read lastsession.ini and switch to its OSC targets
+"""
+import argparse
+import signal
+from pathlib import Path
+from threading import Event
+
+import session
+
+
+class HeadlessSession(session.BpmSession):
+    """BpmSession that reports to the console instead of a GUI"""
+
+    def __init__(self, conf_path: Path = session.CONF_PATH, verbose: bool = False):
+        self.CONF_PATH = conf_path
+        self.verbose = verbose
+        self.printer = None
+        super().__init__()
+
+    def update_bpm_display(self, bpm, send_to: str = "both", Blink=False):
+        if self.verbose and send_to in ("send", "both"):
+            if self.printer is None:
+                from beatfinder import BeatPrinter
+                self.printer = BeatPrinter()
+            self.printer.print_bpm(bpm)
+
+    def reload_targets(self):
+        """Re-read the session file and switch to its OSC targets"""
+        # read merges into the config, targets deleted from the file have to go first
+        for section in self.config.sections():
+            if section.startswith('TARGET:'):
+                self.config.remove_section(section)
+        self.config.read(self.CONF_PATH)
+        if self.update_targets():
+            print(f"OSC targets: {self.osc_client.stats()}", flush=True)
+
+
+def list_devices():
+    """Print all audio input devices with their pyaudio index"""
+    import pyaudio
+
+    audio = pyaudio.PyAudio()
+    for i in range(audio.get_device_count()):
+        info = audio.get_device_info_by_index(i)
+        if info.get('maxInputChannels') > 0:
+            print(f"{i}\t{info.get('name')}")
+    audio.terminate()
+
+
+def find_device(name: str) -> int:
+    """pyaudio index of the first input device whose name contains name"""
+    import pyaudio
+
+    audio = pyaudio.PyAudio()
+    try:
+        for i in range(audio.get_device_count()):
+            info = audio.get_device_info_by_index(i)
+            if info.get('maxInputChannels') > 0 and name.lower() in info.get('name').lower():
+                return i
+    finally:
+        audio.terminate()
+    raise SystemExit(f"No input device matching '{name}'")
+
+
+def run(bpm_session: HeadlessSession, device: int):
+    """Runs until SIGTERM / SIGINT\n
+    Args:
+        bpm_session (HeadlessSession): configured session
+        device (int): pyaudio input device index
+    """
+    stop = Event()
+    settings = bpm_session.config['HEADLESS'] if bpm_session.config.has_section('HEADLESS') else {}
+
+    rate = settings.get('rate', f"1/{settings.get('beat_divider', 1)}")
+    try:
+        bpm_session.set_rate(rate)
+    except ValueError as e:
+        print(f"Ignoring rate = {rate}: {e}")
+    bpm_session.send_bpm = float(settings.get('send_bpm', bpm_session.send_bpm))
+
+    def on_stop(signum, frame):
+        stop.set()
+
+    signal.signal(signal.SIGINT, on_stop)
+    signal.signal(signal.SIGTERM, on_stop)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: bpm_session.resync_bar())
+        signal.signal(signal.SIGUSR2, lambda signum, frame: print(bpm_session.timing.dump(), flush=True))
+        signal.signal(signal.SIGHUP, lambda signum, frame: bpm_session.reload_targets())
+
+    bpm_session.start_stream(device)
+    bpm_session.start_control_server()
+    print(f"Running on device {device}, sending to {bpm_session.config['OSC']['IP']}:{bpm_session.config['OSC']['PORT']}",
+          flush=True)
+
+    if settings.get('sync', 'yes').lower() in ('no', 'false', 'off', '0'):
+        bpm_session.switch_sync(False)
+    if settings.get('resync_on_start', 'yes').lower() not in ('no', 'false', 'off', '0'):
+        bpm_session.resync_bar()
+
+    # wake up regularly, Windows only delivers Ctrl+C between waits
+    while not stop.wait(1):
+        pass
+
+    print("Stopping", flush=True)
+    bpm_session.stop_control_server()
+    bpm_session.stop_stream()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless BPMtoOSC service")
+    parser.add_argument("--ini", type=Path, default=session.CONF_PATH, help="session file (default: %(default)s)")
+    parser.add_argument("--device", help="input device index or part of its name (default: from the session file)")
+    parser.add_argument("--list-devices", action="store_true", help="list audio input devices and exit")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every sent bpm")
+    args = parser.parse_args(argv)
+
+    if args.list_devices:
+        list_devices()
+        return
+
+    bpm_session = HeadlessSession(args.ini, verbose=args.verbose)
+
+    if args.device is None:
+        device = int(bpm_session.config['AUDIO']['device_index'])
+    elif args.device.isdigit():
+        device = int(args.device)
+    else:
+        device = find_device(args.device)
+
+    run(bpm_session, device)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Per stage latency instrumentation for the beat-to-OSC path
+
+Every stage has its own histogram which is only written by one thread
+(the audio callback or the analysis worker), so recording needs no lock.
+Readers may see a slightly stale picture, which is fine for statistics.
+When disabled, the call sites only pay for one attribute check.
+"""
+import math
+
+
+class LatencyHistogram:
+    """Log-spaced histogram of durations from 1us to ~16s"""
+
+    MIN = 1e-6  # seconds, lower edge of the first bin
+    BINS_PER_OCTAVE = 8
+    OCTAVES = 24
+
+    def __init__(self):
+        self.counts = [0] * (self.BINS_PER_OCTAVE * self.OCTAVES)
+        self.total = 0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        if seconds > self.MIN:
+            idx = min(int(math.log2(seconds / self.MIN) * self.BINS_PER_OCTAVE), len(self.counts) - 1)
+        else:
+            idx = 0
+        self.counts[idx] += 1
+        self.total += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> float:
+        """Upper bin edge below which p percent of the samples fall\n
+        Args:
+            p (float): percentile between 0 and 100
+        Returns:
+            float: duration in seconds, 0.0 if nothing was recorded
+        """
+        counts = list(self.counts)  # snapshot, the writer may carry on meanwhile
+        total = sum(counts)
+        if total == 0:
+            return 0.0
+        threshold = total * p / 100
+        seen = 0
+        for idx, count in enumerate(counts):
+            seen += count
+            if seen >= threshold:
+                return min(self.MIN * 2 ** ((idx + 1) / self.BINS_PER_OCTAVE), self.max)
+        return self.max
+
+    def reset(self) -> None:
+        self.counts = [0] * len(self.counts)
+        self.total = 0
+        self.max = 0.0
+
+
+class Instrumentation:
+    """Collection of stage histograms\n
+    Usage at a call site:
+        if timing.enabled:
+            t0 = perf_counter()
+        ...
+        if timing.enabled:
+            timing.record('tempo', perf_counter() - t0)
+    """
+
+    # stages of the beat-to-OSC path in pipeline order
+    STAGES = ("frombuffer", "input", "tempo", "rms", "send_osc", "gui", "beat_to_osc")
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.histograms[stage].record(seconds)
+
+    def summary(self) -> dict:
+        """p50 / p99 / max in milliseconds and the sample count of every stage"""
+        return {stage: {"count": h.total,
+                        "p50_ms": h.percentile(50) * 1000,
+                        "p99_ms": h.percentile(99) * 1000,
+                        "max_ms": h.max * 1000}
+                for stage, h in self.histograms.items()}
+
+    def dump(self) -> str:
+        """Human readable table of summary()"""
+        lines = [f"{'stage':12s} {'count':>8s} {'p50 ms':>9s} {'p99 ms':>9s} {'max ms':>9s}"]
+        for stage, s in self.summary().items():
+            lines.append(f"{stage:12s} {s['count']:8d} {s['p50_ms']:9.3f} {s['p99_ms']:9.3f} {s['max_ms']:9.3f}")
+        return "\n".join(lines)
+
+    def reset(self) -> None:
+        for h in self.histograms.values():
+            h.reset()
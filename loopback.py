@@ -0,0 +1,317 @@
+"""Local OSC receiver stand-in and send path benchmark
+
+LoopbackReceiver takes the place of Resolume: it records every OSC message
+(also inside bundles) with its arrival time. The benchmark drives the plain
+client, the sync send path and the no-sync tempo clock against it at high
+beat rates and measures delivered messages, loss, inter-arrival jitter and
+end-to-end latency. Results are written as JSON to compare releases.
+
+Usage:
+    python loopback.py receive [--port 7000]        # print what would reach Resolume
+    python loopback.py bench [-o results.json]      # run the benchmark
+"""
+import argparse
+import json
+import math
+import platform
+import socket
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from threading import Thread
+from time import perf_counter, sleep
+
+from pythonosc.osc_packet import OscPacket, ParseError
+
+import session
+from probe import PROBE_ADDRESS
+
+BPM_ADDRESS = "/composition/tempocontroller/tempo"
+RESYNC_ADDRESS = "/composition/tempocontroller/resync"
+
+
+class LoopbackReceiver:
+    """Records (arrival perf_counter time, address, first argument) of every received message"""
+
+    def __init__(self, ip: str = "127.0.0.1", port: int = 0, verbose: bool = False, echo: bool = True):
+        """
+        Args:
+            ip (str): interface to listen on
+            port (int): UDP port, 0 picks a free one
+            verbose (bool): print every message
+            echo (bool): answer reachability probes (probe.PROBE_ADDRESS) like an echoing receiver
+        """
+        self.verbose = verbose
+        self.echo = echo
+        self.messages = []
+        self.packets = 0
+        self.invalid = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind((ip, port))
+        self.sock.settimeout(0.1)
+        self._active = True
+        self._thread = Thread(target=self._run, name="LoopbackReceiver", daemon=True)
+        self._thread.start()
+
+    @property
+    def port(self) -> int:
+        return self.sock.getsockname()[1]
+
+    def _run(self):
+        while self._active:
+            try:
+                dgram, sender = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            arrival = perf_counter()
+            self.packets += 1
+            try:
+                messages = [timed.message for timed in OscPacket(dgram).messages]
+            except ParseError:
+                self.invalid += 1
+                continue
+            for message in messages:
+                if self.echo and message.address == PROBE_ADDRESS:
+                    self.sock.sendto(dgram, sender)
+                    continue
+                value = message.params[0] if message.params else None
+                self.messages.append((arrival, message.address, value))
+                if self.verbose:
+                    print(f"{arrival:.6f} {message.address} {value}", flush=True)
+
+    def received(self, address: str) -> list:
+        """(arrival, value) of the messages to address"""
+        return [(t, value) for t, a, value in self.messages if a == address]
+
+    def clear(self):
+        self.messages = []
+        self.packets = self.invalid = 0
+
+    def close(self):
+        self._active = False
+        self._thread.join()
+        self.sock.close()
+
+
+def _bpm_of(value: float) -> int:
+    """Undo the Resolume mapping of a received tempo"""
+    return round(value * 480 + 20)
+
+
+def _stats(sent: int, arrivals: list, latencies: list, period: float = None) -> dict:
+    """Delivery, latency and inter-arrival jitter in ms"""
+    result = {"sent": sent, "delivered": len(arrivals),
+              "loss_percent": round(100 * (1 - len(arrivals) / sent), 3) if sent else 0.0}
+    if latencies:
+        latencies = sorted(latencies)
+        result.update({"latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 4),
+                       "latency_p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 4),
+                       "latency_max_ms": round(latencies[-1] * 1000, 4)})
+    if len(arrivals) > 2:
+        intervals = [b - a for a, b in zip(arrivals, arrivals[1:])]
+        mean = sum(intervals) / len(intervals)
+        reference = period if period is not None else mean
+        result.update({"interval_mean_ms": round(mean * 1000, 4),
+                       "jitter_ms": round(math.sqrt(sum((i - reference) ** 2 for i in intervals) / len(intervals))
+                                          * 1000, 4)})
+    return result
+
+
+def _match_latencies(send_times: dict, received: list) -> tuple:
+    """Arrival times and latencies of received tempo messages, matched by bpm to their last send"""
+    arrivals, latencies = [], []
+    for arrival, value in received:
+        sends = send_times.get(_bpm_of(value))
+        if not sends:
+            continue
+        # latest send before the arrival
+        sent = max((t for t in sends if t <= arrival), default=None)
+        if sent is not None:
+            arrivals.append(arrival)
+            latencies.append(arrival - sent)
+    return arrivals, latencies
+
+
+class _BenchSession(session.BpmSession):
+    """Session that never touches the user's lastsession.ini"""
+    CONF_PATH = Path(tempfile.gettempdir(), "bpmtoosc-bench.ini")
+
+
+def _session(port: int, cls=_BenchSession):
+    """Session sending to the receiver"""
+    bench_session = cls()
+    bench_session.config['OSC']['IP'] = "127.0.0.1"
+    bench_session.config['OSC']['PORT'] = str(port)
+    return bench_session
+
+
+def bench_client(receiver: LoopbackReceiver, messages: int = 20000) -> dict:
+    """OSCclient.send_osc as fast as possible, unique sequence numbers"""
+    from osc_client import OSCclient
+
+    client = OSCclient("127.0.0.1", receiver.port)
+    address = "/bench/sequence"
+    send_times = []
+    start = perf_counter()
+    for i in range(messages):
+        send_times.append(perf_counter())
+        client.send_osc(address, i)
+    elapsed = perf_counter() - start
+    sleep(0.5)
+
+    received = receiver.received(address)
+    latencies = [t - send_times[i] for t, i in received]
+    result = _stats(messages, [t for t, _ in received], latencies)
+    result.update({"messages_per_s": round(messages / elapsed), "send_errors": client.errors,
+                   "reordered": sum(1 for (_, a), (_, b) in zip(received, received[1:]) if b < a)})
+    result.pop("jitter_ms", None)  # a burst has no meaningful interval
+    return result
+
+
+class _ScriptedTempo:
+    """Stands in for the aubio tracker of a BeatDetector without a stream, reports the tempo set by the benchmark"""
+
+    def __init__(self):
+        self.bpm = 0.0
+
+    def get_bpm(self) -> float:
+        return self.bpm
+
+
+def bench_sync_path(receiver: LoopbackReceiver, beats: int = 500, rate: float = 100.0) -> dict:
+    """Detected beats through BeatDetector._on_beat: stabiliser, rate ratio, send gate and the session's
+    queued fan-out client\n
+    The detector has no audio stream, the benchmark sets each beat's stream time and tracker tempo.
+    Every beat carries a new tempo, and the stabiliser follows at once, so every beat is sent.
+
+    Args:
+        beats (int): number of beats
+        rate (float): beats per second, far above any real tempo to stress the path
+    """
+    from beatfinder import BeatDetector
+    from osc_client import AsyncOSCTransport, OSCFanout
+    from stabiliser import BpmStabiliser
+
+    bench_session = _session(receiver.port)
+    client = AsyncOSCTransport(OSCFanout(bench_session.build_targets()))
+    bench_session.osc_client = client
+    bench_session.running = True
+    detector = BeatDetector(client, parent=bench_session, open_stream=False,
+                            stabiliser=BpmStabiliser(window=1, lock_threshold=0, confirm=1))
+    detector.tempo = tracker = _ScriptedTempo()
+    period = 1.0 / rate
+    send_times = {}
+
+    beat_time = 0.0
+    deadline = perf_counter()
+    for n in range(beats):
+        deadline += period
+        while perf_counter() < deadline:
+            sleep(0)
+        # within the range _on_beat passes on
+        tracker.bpm = 60 + n % 140
+        beat_time += 60.0 / tracker.bpm
+        detector.last_beat_time = beat_time
+        send_times.setdefault(tracker.bpm, []).append(perf_counter())
+        detector._on_beat()
+    sleep(0.5)
+    detector.close()
+    client.close()
+
+    arrivals, latencies = _match_latencies(send_times, receiver.received(bench_session.config['OSC']['BPM_ADRESS']))
+    result = _stats(beats, arrivals, latencies, period)
+    result.update({"beats_per_s": rate, "gated": detector.stabiliser.suppressed, "coalesced": client.coalesced,
+                   "dropped": client.dropped})
+    return result
+
+
+def bench_no_sync_path(receiver: LoopbackReceiver, seconds: float = 5.0, bpm: int = 480) -> dict:
+    """The session's manual (no sync) tempo clock, alternating between bpm and bpm - 1 so it sends on every beat"""
+    from osc_client import AsyncOSCTransport, OSCFanout
+
+    send_times = {}
+
+    class BenchSession(_BenchSession):
+        def next_led(self, reset=False, thread=True):
+            # called once per beat just before the send check
+            self.send_bpm = bpm - 1 if self.send_bpm == bpm else bpm
+            send_times.setdefault(self.send_bpm, []).append(perf_counter())
+
+    bench_session = _session(receiver.port, BenchSession)
+    bench_session.osc_client = AsyncOSCTransport(OSCFanout(bench_session.build_targets()))
+    bench_session.send_bpm = bpm
+    bench_session.running = True
+    bench_session.switch_sync(False)
+    sleep(seconds)
+    bench_session.switch_sync(True)
+    sleep(0.5)
+    bench_session.tempo_clock.close()
+    bench_session.osc_client.close()
+
+    arrivals, latencies = _match_latencies(send_times, receiver.received(BPM_ADDRESS))
+    sent = sum(len(times) for times in send_times.values())
+    # the period alternates, compare with the average one
+    return _stats(sent, arrivals, latencies, 60.0 / (bpm - 0.5))
+
+
+def run_benchmark(output: Path = None, beats: int = 500, rate: float = 100.0, bpm: int = 480,
+                  seconds: float = 5.0) -> dict:
+    """All send path benchmarks against one LoopbackReceiver\n
+    Args:
+        output (Path, optional): JSON file to write the results to
+        beats (int): beats for the sync path
+        rate (float): beats per second for the sync path
+        bpm (int): tempo of the no-sync path
+        seconds (float): duration of the no-sync path
+    Returns:
+        dict: results per path plus the environment
+    """
+    receiver = LoopbackReceiver()
+    results = {"date": datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(), "platform": platform.platform()}
+    try:
+        for name, bench in (("client", lambda: bench_client(receiver)),
+                            ("sync", lambda: bench_sync_path(receiver, beats, rate)),
+                            ("no_sync", lambda: bench_no_sync_path(receiver, seconds, bpm))):
+            receiver.clear()
+            results[name] = bench()
+    finally:
+        receiver.close()
+
+    if output is not None:
+        output.write_text(json.dumps(results, indent=2))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Loopback OSC receiver and send path benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+    receive = commands.add_parser("receive", help="print received OSC messages")
+    receive.add_argument("--ip", default="127.0.0.1")
+    receive.add_argument("--port", type=int, default=7000)
+    bench = commands.add_parser("bench", help="benchmark the send paths")
+    bench.add_argument("-o", "--output", type=Path, help="write the results as JSON")
+    bench.add_argument("--beats", type=int, default=500, help="beats for the sync path (default: %(default)s)")
+    bench.add_argument("--rate", type=float, default=100.0,
+                       help="beats per second for the sync path (default: %(default)s)")
+    bench.add_argument("--bpm", type=int, default=480, help="tempo of the no-sync path (default: %(default)s)")
+    bench.add_argument("--seconds", type=float, default=5.0, help="duration of the no-sync path (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.command == "receive":
+        receiver = LoopbackReceiver(args.ip, args.port, verbose=True)
+        print(f"Listening on {args.ip}:{receiver.port}, Ctrl+C to stop", flush=True)
+        try:
+            while True:
+                sleep(1)
+        except KeyboardInterrupt:
+            receiver.close()
+    else:
+        print(json.dumps(run_benchmark(args.output, args.beats, args.rate, args.bpm, args.seconds), indent=2))
+
+
+if __name__ == "__main__":
+    main()
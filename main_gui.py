@@ -8,23 +8,18 @@
 #   Python, Pylance, GitLens, German language pack,Python Docstring Generator
 #
 # TODO:
-# - Other output (Midi clock?)
 # - Darkmode?
 
 # Imports:
-from os import remove, system
-from pathlib import Path
-from subprocess import call
-from platform import system
-from time import time
-from threading import Thread, Event
 
 # local
-from sevensegment import SevenSegmentDisp
-import beatfinder
-import osc_client
+from bpmdisplay import BpmDisplay
+from rate import RATIOS
+from uidispatch import DisplayState, UiDispatcher
+import profiles
+import session
+from probe import ReachabilityProbe
 
-import configparser
 import pyaudio
 
 
@@ -33,12 +28,11 @@ import wx.lib.masked.ipaddrctrl as ipctrl
 import wx.lib.agw.peakmeter as PM
 
 
-class Main_Frame(wx.Frame):
+class Main_Frame(wx.Frame, session.BpmSession):
     '''Frame Class
     '''
     sel_msg_frame = None
     sel_bus_frame = None
-    CONF_PATH = Path(Path.home(), "AppData/Roaming/BPMtoOSC/lastsession.ini")
     #CONF_PATH = Path("lastsession.ini")
 
     def __init__(self, parent=None):
@@ -50,8 +44,8 @@ class Main_Frame(wx.Frame):
         style_dep = wx.DEFAULT_FRAME_STYLE ^ wx.MAXIMIZE_BOX  # ^ wx.RESIZE_BORDER
         super(Main_Frame, self).__init__(parent, title="BPMtoOSC", style=style_dep)
 
-        # Config Setup
-        self.config = configparser.ConfigParser()
+        # Session state and config (wx independent part)
+        session.BpmSession.__init__(self)
 
         # Manage close event
         wx.CloseEvent.SetCanVeto(wx.CloseEvent(), False)
@@ -60,34 +54,23 @@ class Main_Frame(wx.Frame):
         self.audio = pyaudio.PyAudio()
         self.audio_device = 1
 
-        # OSC Setup
-        self.osc_client = None
-
-        # BPM Setup
-        self.beatfinder = None  # audio analysis instance
-        self.send_bpm = 128  # sent bpm when sync is diasabled (used to hold last live or tap value)
-        self.beat_divider = 1  # divides beat to get 1/2, 1/4
-        self.no_sync_send_thread = Thread(target=self.send_thread_when_no_sync)
-
-        self.bpm_thread_wait_and_terminate = Event()  # c based event to wait in thread or terminate
-        self.bpm_thread_wait_and_terminate.clear()
-
-        self.last_tap = list()  # list of taps to determine bpm
         self.buttons_to_disable = list()  # list of buttons to disableon start/stop
 
-        # Flags
-        self.bpm_blink = False  # Blinking sevenseg background
-        self.sync = True  # sync live bpm to send bpm
-        self.resync = False  # resync to bar
-        self.running = False
-        self.retrys = 3
-        self.led_counter = 3
+        # display updates from worker threads, applied on the GUI thread
+        self.ui = UiDispatcher(self.apply_display)
+        self.shown = DisplayState()  # what the widgets currently show
+        self.shown.led = None  # all LEDs off
 
-        self.Read_LastSession_ini()
         self.InitUI()
 
         self.Centre()  # centre window on screen
 
+        # OSC target reachability, replaces the ICMP ping
+        self.probe = ReachabilityProbe()
+
+        # tap, resync, sync and nudge over OSC, see [CONTROL] in lastsession.ini
+        self.start_control_server()
+
 # PEAK METER
         self.uv_timer = wx.Timer(self)
         self.Bind(wx.EVT_TIMER, self.OnUVTimer)
@@ -97,31 +80,10 @@ class Main_Frame(wx.Frame):
         #self.peak_meter.SetData(0, 0, 1)
 
     def OnUVTimer(self, event):
-        if self.running:
-            avg = [sum(self.beatfinder.level_queue)/len(self.beatfinder.level_queue)
-                   if len(self.beatfinder.level_queue) > 0 else 0]
-            # print(avg)
-            self.peak_meter.SetData(avg, 0, 1)
-            pass
-
-    def Read_LastSession_ini(self):
-        """Reading / creating lastsession.ini
-        """
-        try:
-            # if no config found, create one with default values
-            self.config.read(self.CONF_PATH)
-            if self.config.sections() == []:
-                self.config['OSC'] = {'IP': '127.000.000.001',
-                                      'PORT': 7000,
-                                      'RESYNC_BAR_ADRESS': '/composition/tempocontroller/resync',
-                                      'BPM_ADRESS': '/composition/tempocontroller/tempo'}
-                self.config['AUDIO'] = {'device_index': '1'}
-        except:
-            if self.retrys > 0:
-                self.retrys -= 1
-                print("Error reading config file. Deleting and creating new one.")
-                remove(self.CONF_PATH)
-                self.Read_LastSession_ini()
+        if self.running and self.beatfinder:
+            # one consistent snapshot of (rms, peak, decayed level, peak hold)
+            rms, peak, level, hold = self.beatfinder.meter.snapshot()
+            self.peak_meter.SetData([int(level * 200)], 0, 1)
 
     def InitUI(self):
         """Actual GUI Setup of main config Window
@@ -144,6 +106,7 @@ class Main_Frame(wx.Frame):
         # Textbox IP-Adress
         self.text_ip = ipctrl.IpAddrCtrl(panel)
         self.text_ip.SetValue(self.config['OSC']['IP'])
+        self.Bind(wx.EVT_TEXT, self.on_target_changed, self.text_ip)
         self.ip_stuff_sizer.Add(self.text_ip, 0, wx.LEFT | wx.RIGHT | wx.ALIGN_CENTER, border=5)
 
         # Numberbox Port
@@ -151,6 +114,7 @@ class Main_Frame(wx.Frame):
         self.text_port.SetMax(65535)
         self.text_port.SetMin(0)
         self.text_port.SetValue(self.config['OSC']['PORT'])
+        self.Bind(wx.EVT_SPINCTRL, self.on_target_changed, self.text_port)
         self.ip_stuff_sizer.Add(self.text_port, 0, wx.LEFT | wx.RIGHT | wx.ALIGN_CENTER, border=5)
         
         #self.ip_stuff_sizer.AddStretchSpacer()
@@ -193,6 +157,14 @@ class Main_Frame(wx.Frame):
 
         audiosizer.Add(self.audio_selection, 2, wx.EXPAND | wx.ALL, border=5)
 
+        # Latency profile selection
+        self.profile_names = profiles.profile_names(self.config)
+        self.profile_selection = wx.Choice(panel, choices=[profiles.describe(self.config, name)
+                                                           for name in self.profile_names])
+        if self.config['AUDIO']['profile'] in self.profile_names:
+            self.profile_selection.SetSelection(self.profile_names.index(self.config['AUDIO']['profile']))
+        audiosizer.Add(self.profile_selection, 1, wx.EXPAND | wx.ALL, border=5)
+
 # PEAK METER
         self.peak_meter = PM.PeakMeterCtrl(panel, -1, style=wx.SIMPLE_BORDER, agwStyle=PM.PM_HORIZONTAL)
         self.peak_meter.SetMeterBands(1, 48)
@@ -236,30 +208,29 @@ class Main_Frame(wx.Frame):
 # SEVEN SEGMENT DISPLAYS
         sevenseg_sizer = wx.BoxSizer(orient=wx.HORIZONTAL)
 
-        self.live_disp = (SevenSegmentDisp(panel), SevenSegmentDisp(panel), SevenSegmentDisp(panel))
-        self.send_disp = (SevenSegmentDisp(panel), SevenSegmentDisp(panel), SevenSegmentDisp(panel))
+        self.live_disp = BpmDisplay(panel, digits=3)
+        self.send_disp = BpmDisplay(panel, digits=3)
 
         # DISPLAY 1
         bpm_box_live = wx.StaticBoxSizer(wx.HORIZONTAL, panel, label="LIVE")
-        for digit in self.live_disp:
-            digit.SetTilt(5)
-            digit.SetColours(segment_on=((0, 71, 77)), background=self.bg_grey, segment_off=(220, 220, 220))
-            digit.SetGeometry(width=38, height=38, thickness=10, separation=2)
-            digit.EnableDot(False)
-            digit.EnableColon(False)
-            digit.SetValue("-")
-            bpm_box_live.Add(digit, 1, wx.EXPAND | wx.DOWN, 5)
+        self.live_disp.SetColours(segment_on=((0, 71, 77)))
+        bpm_box_live.Add(self.live_disp, 1, wx.EXPAND | wx.DOWN, 5)
 
         # DISPLAY 2
         bpm_box_sending = wx.StaticBoxSizer(wx.HORIZONTAL, panel, label="SEND")
-        for digit in self.send_disp:
-            digit.SetTilt(5)
-            digit.SetColours(segment_on=(85, 0, 0), background=self.bg_grey, segment_off=(220, 220, 220))
-            digit.SetGeometry(width=38, height=38, thickness=10, separation=2)
-            digit.EnableDot(False)
-            digit.EnableColon(False)
-            digit.SetValue("-")
-            bpm_box_sending.Add(digit, 1, wx.EXPAND | wx.DOWN, 5)
+        self.send_disp.SetColours(segment_on=(85, 0, 0))
+        bpm_box_sending.Add(self.send_disp, 1, wx.EXPAND | wx.DOWN, 5)
+
+        for disp in (self.live_disp, self.send_disp):
+            disp.SetTilt(5)
+            # blinking background, alternates with every beat
+            background, segment_off = self.bg_a
+            disp.SetBlinkColours(dict(background=background, segment_off=segment_off),
+                                 dict(background=segment_off, segment_off=background))
+            disp.SetGeometry(width=38, height=38, thickness=10, separation=2)
+            disp.EnableDot(True)  # fractional bpm at rate ratios like 2/3
+            disp.EnableColon(False)
+            disp.SetDisplay("---")
 
         sevenseg_sizer.Add(bpm_box_live, 3, wx.EXPAND | wx.LEFT, 10)
         
@@ -276,12 +247,13 @@ class Main_Frame(wx.Frame):
         self.sevenseg_button_sizer.Add(self.button_sync, 3, wx.EXPAND, 5)
         self.Bind(wx.EVT_TOGGLEBUTTON, self.on_button_sync, self.button_sync)
         
-# Live Halftime Button
-        self.button_halftime = wx.ToggleButton(panel, label='1/2')
-        self.button_halftime.SetFont(buttonfont)
-        self.buttons_to_disable.append(self.button_halftime)
-        self.sevenseg_button_sizer.Add(self.button_halftime, 1, wx.EXPAND, 5)
-        self.Bind(wx.EVT_TOGGLEBUTTON, self.on_button_halftime, self.button_halftime)
+# Live Rate Ratio Choice (1/2 is halftime, 3/2 triplet feel)
+        self.choice_rate = wx.Choice(panel, choices=list(RATIOS))
+        self.choice_rate.SetStringSelection("1")
+        self.choice_rate.SetFont(buttonfont)
+        self.buttons_to_disable.append(self.choice_rate)
+        self.sevenseg_button_sizer.Add(self.choice_rate, 1, wx.EXPAND, 5)
+        self.Bind(wx.EVT_CHOICE, self.on_choice_rate, self.choice_rate)
         
         # add the sevensesg button sizer between the displays
         sevenseg_sizer.Add(self.sevenseg_button_sizer, 1, wx.EXPAND | wx.UP, 5)
@@ -361,6 +333,11 @@ class Main_Frame(wx.Frame):
         for b in self.buttons_to_disable:
             b.Disable()
 
+        # Ctrl+I dumps the latency histograms
+        dump_id = wx.NewIdRef()
+        self.Bind(wx.EVT_MENU, self.on_dump_timing, id=dump_id)
+        self.SetAcceleratorTable(wx.AcceleratorTable([(wx.ACCEL_CTRL, ord('I'), dump_id)]))
+
         # some window properties
         self.Bind(wx.EVT_CLOSE, self.close)
         self.SetMinSize(wx.Size(645, 650))
@@ -372,45 +349,52 @@ class Main_Frame(wx.Frame):
         sizer.Fit(self)
 
     def on_button_plus_one(self, event):
-        self.on_button_halftime(None, reset=True)
         self.next_led()
-        if self.sync:
-            self.switch_sync(False)
-        if self.send_bpm < 499:
-            self.send_bpm += 1
-            self.update_bpm_display(self.send_bpm, send_to="send")
+        self.nudge(1)
 
     def on_button_minus_one(self, event):
-        self.on_button_halftime(None, reset=True)
-        if self.sync:
-            self.switch_sync(False)
-        if self.send_bpm > 20:
-            self.send_bpm -= 1
-            self.update_bpm_display(self.send_bpm, send_to="send")
+        self.nudge(-1)
 
     def on_button_double(self, event):
-        self.on_button_halftime(None, reset=True)
-        if self.sync:
-            self.switch_sync(False)
-        if self.send_bpm*2 <= 500:
-            self.send_bpm *= 2
-            self.update_bpm_display(self.send_bpm, send_to="send")
+        self.scale_send_bpm(2)
 
     def on_button_half(self, event):
-        self.on_button_halftime(None, reset=True)
-        if self.sync:
-            self.switch_sync(False)
-        if self.send_bpm/2 >= 20:
-            self.send_bpm = round(self.send_bpm/2)
-            self.update_bpm_display(self.send_bpm, send_to="send")
-
-    def on_button_halftime(self, event, reset=False):
-        if reset:
-            self.button_halftime.SetValue(False)
-        
-        self.beat_divider = 2 if self.button_halftime.GetValue() else 1
+        self.scale_send_bpm(0.5)
+
+    def on_choice_rate(self, event):
+        self.set_rate(self.choice_rate.GetStringSelection())
+
+    def rate_changed(self, ratio):
+        if not wx.IsMainThread():
+            # e.g. from the OSC control server
+            wx.CallAfter(self.rate_changed, ratio)
+            return
+        if not self.choice_rate.SetStringSelection(str(ratio)):
+            # e.g. set in lastsession.ini
+            self.choice_rate.SetSelection(self.choice_rate.Append(str(ratio)))
+
+    def effective_rate_changed(self, effective):
+        if not wx.IsMainThread():
+            # from the analysis worker
+            wx.CallAfter(self.effective_rate_changed, effective)
+            return
+        if effective == self.rate.ratio:
+            self.choice_rate.SetForegroundColour(wx.NullColour)
+            self.choice_rate.UnsetToolTip()
+        else:
+            # the chosen ratio would leave Resolume's tempo range at this tempo
+            self.choice_rate.SetForegroundColour((220, 150, 60))
+            self.choice_rate.SetToolTip(f"Sent as {effective} to stay within 20..500 BPM")
+        self.choice_rate.Refresh()
 
 
+    def on_dump_timing(self, event):
+        """Print the per stage latency histograms"""
+        if self.timing.enabled:
+            print(self.timing.dump())
+        else:
+            print("Timing is disabled, set timing = yes in the [DEBUG] section of lastsession.ini")
+
     def on_button_reload(self, event):
         """Reloads the audio devices"""
 
@@ -443,51 +427,14 @@ class Main_Frame(wx.Frame):
         Args:
             event (ex.EVENT): unused
         """
-
-        # calculate only after 2+ tabs
-        if len(self.last_tap) > 1:
-
-            # add time and timedelta to list
-            self.last_tap.append((time(), time() - self.last_tap[-1][0]))
-
-            # Clear if previous taps are too old
-            if time() - self.last_tap[-2][0] > 1:
-                self.last_tap = [self.last_tap[-1]]
-
-            else:
-                # disable sync if it was enabled
-                # this also starts the osc sending thread
-                if self.sync:
-                    self.switch_sync(False)
-
-                # Calculate the BPM, set variable for thread and display it
-                self.send_bpm = round(60 / (sum([x[1] for x in self.last_tap[1:]]) / len(self.last_tap[1:])))
-                self.update_bpm_display(self.send_bpm, send_to="send")
-
-        elif len(self.last_tap) == 1:
-            self.last_tap.append((time(), time() - self.last_tap[-1][0]))
-
-        else:
-            # if no taps yet, add first tap
-            self.last_tap.append((time(), None))
+        self.tap()
 
     def on_button_sync(self, event):
         self.switch_sync(self.button_sync.GetValue())
         self.button_resync.BackgroundColour = self.bg_grey
 
     def on_button_resync(self, event):
-        # reset bar animation
-        self.next_led(reset=True)
-
-        # reset bpm timer
-        self.resync = True
-        self.bpm_thread_wait_and_terminate.set()
-
-        if self.beatfinder:
-            self.beatfinder.resync_bar()
-
-        self.resync = False
-        self.bpm_thread_wait_and_terminate.clear()
+        self.resync_bar()
 
     def on_button_startstop(self, event):
         """Starts and stops the audio and OSC stream
@@ -502,227 +449,136 @@ class Main_Frame(wx.Frame):
             self.config['AUDIO']['device_index'] = str(self.audio_selection.GetSelection())
             self.config['OSC']['IP'] = self.text_ip.GetValue().replace(" ", "")
             self.config['OSC']['PORT'] = str(self.text_port.GetValue())
+            if self.profile_selection.GetSelection() != wx.NOT_FOUND:
+                self.config['AUDIO']['profile'] = self.profile_names[self.profile_selection.GetSelection()]
 
             # create worker instances
-            self.osc_client = osc_client.OSCclient(self.config['OSC']['IP'], int(self.config['OSC']['PORT']))
-            self.beatfinder = beatfinder.BeatDetector(self.osc_client, self.audio_selection.GetSelection(), parent=self)
+            self.start_stream(self.audio_selection.GetSelection())
 
             # gui changes
             self.button_startstop.SetBackgroundColour((220, 150, 150))
             self.audio_selection.Disable()
+            self.profile_selection.Disable()
             for b in self.buttons_to_disable:
                 b.Enable()
 
-            self.running = True
-
         else:
             print("Stopping")
 
-            self.running = False
-
             # delete worker instances
-            del self.beatfinder
-            self.beatfinder = None
-            del self.osc_client
-            self.osc_client = None
+            self.stop_stream()
 
             # gui changes
             self.audio_selection.Enable()
+            self.profile_selection.Enable()
             for b in self.buttons_to_disable:
                 b.Disable()
             self.button_startstop.SetBackgroundColour(wx.NullColour)
             self.peak_meter.SetData([0], 0, 1)
             self.update_bpm_display("---", send_to="both")
 
+    def on_target_changed(self, event):
+        """Switch the running stream to the edited IP / port"""
+        if self.running and self.text_ip.IsValid():
+            self.config['OSC']['IP'] = self.text_ip.GetValue().replace(" ", "")
+            self.config['OSC']['PORT'] = str(self.text_port.GetValue())
+            self.update_targets()
+
     def on_button_ping(self, event):
-        '''Establish Websocket connection
-            - Create Websocket connection
-            - Set Status in Interface wether connected, connecting or connection error
+        '''Probe the OSC target
+            - Sends OSC queries to the target port on the probe thread, the GUI stays responsive
+            - Set Status in Interface wether reachable, port closed or no reply
         '''
-        # set gui status: connecting
-        wx.SetCursor(wx.Cursor(wx.CURSOR_WAIT))
+        # set gui status: probing
         self.button_ping.Disable()
-        #self.text_connection.SetForegroundColour((255, 206, 13))
-        #self.text_connection.SetLabel("Pinging...")
+        self.text_connection.SetForegroundColour((255, 206, 13))
+        self.text_connection.SetLabel("Probing...")
         self.ip_stuff_sizer.Layout()
 
         # save input to config
         self.config['OSC']['IP'] = self.text_ip.GetValue()
         self.config['OSC']['PORT'] = str(self.text_port.GetValue())
 
-        # send ping
-        param = '-n' if system().lower() == 'windows' else '-c'
-        command = ['ping', param, '1', self.config['OSC']['IP'].replace(" ", "")]
-
-        # success
-        if call(command) == 0:
-            self.text_connection.SetForegroundColour((0, 184, 0))
-            self.text_connection.SetLabel("Reachable")
-            self.ip_stuff_sizer.Layout()
+        # repeated clicks within the TTL get the cached result
+        future = self.probe.probe(self.config['OSC']['IP'], int(self.config['OSC']['PORT']))
+        future.add_done_callback(lambda f: wx.CallAfter(self.on_probe_result, f.result()))
 
-        # no answer
-        else:
-            print('No ping answer')
-            self.text_connection.SetForegroundColour((220, 0, 0))
-            self.text_connection.SetLabel("Unreachable")
-            self.ip_stuff_sizer.Layout()
+    def on_probe_result(self, result):
+        """Show the result of the reachability probe\n
+        Args:
+            result (probe.ProbeResult): state and round trip times
+        """
+        colours = {"reachable": (0, 184, 0), "no reply": (255, 206, 13)}
+        self.text_connection.SetForegroundColour(colours.get(result.state, (220, 0, 0)))
+        self.text_connection.SetLabel(str(result))
+        self.ip_stuff_sizer.Layout()
+        if result.rtt is not None:
+            print(f"RTT {self.probe.rtt_stats(self.config['OSC']['IP'], int(self.config['OSC']['PORT']))}")
+            self.set_network_latency(result.rtt)
 
         # gui restore
-        wx.SetCursor(wx.Cursor(wx.CURSOR_DEFAULT))
         self.button_ping.Enable()
 
-    def switch_sync(self, state: bool):
-        """Changes state of sync flag and button\n
-        Starts thread to emit "send bpm" 
-
+    def sync_changed(self, state: bool):
+        """Updates the sync button and the rate choice after switch_sync\n
         Args:
-            state (bool): State to switch to
+            state (bool): new sync state
         """
+        if not wx.IsMainThread():
+            # e.g. from the OSC control server
+            wx.CallAfter(self.sync_changed, state)
+            return
+
         #stop sync
-        if not state and self.sync:
-            self.bpm_thread_wait_and_terminate.clear()  # clearing thread terminating event
-            self.sync = False
+        if not state:
             self.button_sync.SetForegroundColour((220, 150, 150))
             # self.button_sync.SetLabel('❌')
             
             self.button_sync.SetValue(False)
             
-            #must be called first to get the beat_divider into the thread
-            self.no_sync_send_thread = Thread(target=self.send_thread_when_no_sync)
-            self.no_sync_send_thread.start()
-            
-            #self.button_halftime.SetValue(False)
-            self.button_halftime.Disable()
-            #self.on_button_halftime(None)
+            self.choice_rate.Disable()
 
         #start sync
-        elif state and not self.sync:
-            self.bpm_thread_wait_and_terminate.set()  # setting thread terminating event
-            self.sync = False
-            self.sync = True
+        else:
             self.button_sync.SetForegroundColour((150, 220, 150))
             # self.button_sync.SetLabel('➜')
             self.button_sync.SetValue(True)
             
-            self.button_halftime.SetValue(True if self.beat_divider == 2 else False)
-            self.button_halftime.Enable()
-        else:
-            print("Sync state already set to {}".format(state))
+            self.rate_changed(self.rate.ratio)
+            self.choice_rate.Enable()
 
     def update_bpm_display(self, bpm, send_to: str = "both", Blink=False):
-        """Iterates through digits and sets them accordinglly
+        """Posts a bpm value for the displays, safe from any thread
 
         Args:
-            bpm (int | str): bpm value to set
+            bpm (int | float | str): bpm value to set
             send_to (str): wich display to update, can be "both", "live" or "send". Defaults to "both."
             Blink (bool, optional): wether the background should alternate color. Defaults to False.
         """
-        # convert to array of chars
-
-        def set_digits(bpm, send_to):
-
-            bpm_digits = [d for d in str(bpm)]
-            bpm_digits.reverse()
+        self.ui.post_bpm(bpm, send_to, Blink)
 
-            def send_to_disp(disp):
-                """actual update function
-
-                Args:
-                    disp (self.live_disp | self.send_disp): display to update
-                """
-                # set new background color
-                new_bg = self.bg_a[::-1] if disp[0].GetColours()['background'] == self.bg_grey else self.bg_a
-                
-                for i, digit in enumerate(disp):
-
-                    # set 0 in front if bpm has less than 3 digits
-                    if len(bpm_digits) > 2:
-                        digit.SetValue(bpm_digits[2-i])
-                    else:
-                        digit.SetValue(bpm_digits[2-i] if i > 0 else 0)
-
-                    # blinking background
-                    if Blink:
-                        digit.SetColours(background=new_bg[0], segment_off=new_bg[1])
-
-
-            # send to display
-            if send_to == "both":
-                send_to_disp(self.live_disp)
-                send_to_disp(self.send_disp)
-            elif send_to == "send":
-                send_to_disp(self.send_disp)
-            elif send_to == "live":
-                send_to_disp(self.live_disp)
-
-            self.bpm_blink = not (self.bpm_blink)
+    def next_led(self, reset=False, thread=True):
+        """Posts the next beat LED, safe from any thread (thread is kept for callers, no thread is started)"""
+        self.ui.post_led(reset)
 
-        Thread(target=set_digits, args=(bpm, send_to)).start()
+    def apply_display(self, state: DisplayState):
+        """Bring the widgets to state, only what changed since the last call (GUI thread)"""
+        if not self:
+            # frame already destroyed
+            return
 
-    def next_led(self, reset=False, thread=True):
+        for name, disp in (("live", self.live_disp), ("send", self.send_disp)):
+            # 0 in front if bpm has less than 3 digits, only changed digits get repainted
+            disp.SetDisplay(state.values[name], state.blinks[name] % 2)
 
-        def set_leds(rst):
-            def set_background(led, color: tuple):
-                # need to update label to see changes
-                led.SetBackgroundColour(color)
-                led.Refresh()
-            if rst:
-                set_background(self.leds[0], (200, 0, 0))
-                set_background(self.leds[1], (50, 0, 0))
-                set_background(self.leds[2], (50, 0, 0))
-                set_background(self.leds[3], (50, 0, 0))
-                if self.led_counter == 0:
-                    self.led_counter = -1
-                else:
-                    self.led_counter = 3
-            if self.led_counter < 3:
-                set_background(self.leds[self.led_counter], (50, 0, 0))
-                set_background(self.leds[self.led_counter+1], (200, 0, 0))
-                self.led_counter += 1
-            else:
-                self.led_counter = 0
-                set_background(self.leds[-1], (50, 0, 0))
-                set_background(self.leds[self.led_counter], (200, 0, 0))
-
-        if thread:
-            Thread(target=set_leds, args=(reset,)).start()
-        else:
-            set_leds(reset)
+        if state.led != self.shown.led:
+            for i, led in enumerate(self.leds):
+                if i in (state.led, self.shown.led):
+                    # need to update label to see changes
+                    led.SetBackgroundColour((200, 0, 0) if i == state.led else (50, 0, 0))
+                    led.Refresh()
 
-    def send_thread_when_no_sync(self):
-        """When sync is disabled, this thread sends the bpm showed in send display.\n
-        This can either be an old live value or a tabbed in value.
-        A more efficient way is needed.
-        """
-        """# time compensation over 4 beats to be more accurate
-            beat_counter += 1
-            if beat_counter == 1:
-                prev = time.time() # time compensation
-            elif beat_counter == 4:
-                comp = (time.time() - prev) - ((60/self.send_bpm)*8)
-                beat_counter = 0"""
-        # trigger at least once set_osc
-        prev_bpm = self.send_bpm
-        self.send_bpm//=self.beat_divider
-        #self.osc_client.send_osc(self.config['OSC']['BPM_ADRESS'], self.send_bpm, map_to_resolume=True)
-
-        # send bpm only on change
-        while True:
-            prev_time = time()  # time compensation
-            self.next_led(thread=False)
-            #self.osc_client.send_osc("/composition/tempocontroller/tempo", self.send_bpm, map_to_resolume=True)
-
-            if prev_bpm != self.send_bpm:
-                self.osc_client.send_osc(self.config['OSC']['BPM_ADRESS'], self.send_bpm, map_to_resolume=True)
-                self.update_bpm_display(self.send_bpm, send_to="send", Blink=True) # send bpm to send display
-                prev_bpm = self.send_bpm
-                
-            # efficient c based busy wating with instant return option
-            if self.bpm_thread_wait_and_terminate.wait(60/self.send_bpm - (time()-prev_time)):
-                if self.resync:
-                    continue
-                else:
-                    return
+        self.shown = state
 
     def close(self, event):  # save settings to ini and close down
         """Ask User if event can be vetoed (No force close event).
@@ -737,12 +593,10 @@ class Main_Frame(wx.Frame):
                     pass
                 return
 
-        # create directory if it does not exist
-        self.CONF_PATH.parent.mkdir(parents=True, exist_ok=True)
-
         # save config
-        with open(self.CONF_PATH, 'w') as configfile:
-            self.config.write(configfile)
+        self.Write_LastSession_ini()
+        self.stop_control_server()
+        self.probe.close()
 
         # close everything
         self.Destroy()
@@ -750,17 +604,17 @@ class Main_Frame(wx.Frame):
     def __del__(self):
         """stop all threads and close down
         """
-        self.bpm_thread_wait_and_terminate.set()
+        self.tempo_clock.close()
         self.running = False
         self.sync = False
         self.uv_timer.stop()
         self.peak_meter.Stop()
 
-        self.no_sync_send_thread.join()
-
         if self.beatfinder:
+            self.beatfinder.close()
             del self.beatfinder
         if self.osc_client:
+            self.osc_client.close()
             del self.osc_client
 
         self.parent.Destroy()
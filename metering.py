@@ -0,0 +1,101 @@
+"""Level metering for the analysis worker
+
+The worker writes per block RMS and true peak into a fixed numpy array and
+publishes the current meter state as one tuple, so the GUI timer gets a
+consistent snapshot with a single attribute read and no lock.
+"""
+import math
+
+import numpy as np
+
+
+class LevelMeter:
+    """RMS / peak meter with decay, peak hold and a history ring"""
+
+    def __init__(self, block_size: int, samplerate: int, history_seconds: float = 10.0,
+                 release: float = 0.3, hold: float = 1.0):
+        """
+        Args:
+            block_size (int): frames per update() call
+            samplerate (int): sample rate of the blocks
+            history_seconds (float): length of the RMS / peak history
+            release (float): time constant of the level decay in seconds
+            hold (float): how long the peak hold stays before it decays
+        """
+        block_time = block_size / samplerate
+        self.block_time = block_time
+        self.history_blocks = max(1, int(history_seconds / block_time))
+        self._history = np.zeros((self.history_blocks, 2), dtype=np.float32)  # rows of (rms, peak)
+        self._index = 0  # total blocks written
+
+        self._decay = math.exp(-block_time / release)
+        self._hold_blocks = int(hold / block_time)
+        self._level = 0.0
+        self._hold = 0.0
+        self._hold_age = 0
+
+        # (rms, peak, decayed level, peak hold) of the last block, replaced as a whole
+        self._snapshot = (0.0, 0.0, 0.0, 0.0)
+
+    def update(self, signal: np.ndarray) -> None:
+        """Meter one block (writer side, only called from one thread)\n
+        Args:
+            signal (np.ndarray): float32 samples
+        """
+        rms = math.sqrt(float(signal.dot(signal)) / signal.size)
+        peak = max(float(signal.max()), -float(signal.min()))
+
+        row = self._history[self._index % self.history_blocks]
+        row[0] = rms
+        row[1] = peak
+        self._index += 1
+
+        # fast attack, exponential release
+        self._level = max(rms, self._level * self._decay)
+
+        # peak hold, decays like the level once the hold time is over
+        if peak >= self._hold:
+            self._hold = peak
+            self._hold_age = 0
+        elif self._hold_age < self._hold_blocks:
+            self._hold_age += 1
+        else:
+            self._hold = max(peak, self._hold * self._decay)
+
+        self._snapshot = (rms, peak, self._level, self._hold)
+
+    def snapshot(self) -> tuple:
+        """Consistent meter state, safe to call from any thread\n
+        Returns:
+            (float, float, float, float): rms, peak, decayed level and peak hold of the last block
+        """
+        return self._snapshot
+
+    def history(self, points: int = None) -> np.ndarray:
+        """RMS / peak history, oldest first\n
+        Args:
+            points (int, optional): decimate to this many rows, taking the maximum of each group
+        Returns:
+            np.ndarray: copy of shape (rows, 2) with columns rms and peak
+        """
+        index = self._index
+        filled = min(index, self.history_blocks)
+        start = index % self.history_blocks
+        if filled < self.history_blocks:
+            data = self._history[:filled].copy()
+        else:
+            data = np.concatenate((self._history[start:], self._history[:start]))
+
+        if points is None or points >= data.shape[0] or points <= 0:
+            return data
+        # drop the oldest rows that do not fill a whole group
+        group = data.shape[0] // points
+        data = data[data.shape[0] - group * points:]
+        return data.reshape(points, group, 2).max(axis=1)
+
+    def reset(self) -> None:
+        self._history[:] = 0
+        self._index = 0
+        self._level = self._hold = 0.0
+        self._hold_age = 0
+        self._snapshot = (0.0, 0.0, 0.0, 0.0)
@@ -0,0 +1,266 @@
+"""MIDI clock output
+
+MidiClock sends 24 clock pulses per beat from its own thread. Every pulse
+has an absolute deadline derived from the previous deadline, never from the
+time the previous pulse actually went out, so lateness does not add up to
+drift. Tempo changes ramp linearly over a configurable time, and the
+transport messages start / stop / continue / song position are supported.
+
+Ports come from python-rtmidi (optional, only needed for real output);
+LoopbackPort records the messages instead, for measuring without hardware.
+
+Usage:
+    python midi_clock.py    # jitter / drift benchmark against a loopback port
+"""
+from threading import Thread, Event, Lock
+from time import perf_counter, sleep
+
+from deadline import clearing_wait, wait_until, missed
+from instrumentation import LatencyHistogram
+from osc_client import ClientWrapper
+
+CLOCK = 0xF8
+START = 0xFA
+CONTINUE = 0xFB
+STOP = 0xFC
+SONG_POSITION = 0xF2
+
+
+class LoopbackPort:
+    """Stand-in output port that records (perf_counter time, message)"""
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, message: list):
+        self.messages.append((perf_counter(), message))
+
+    def clock_times(self) -> list:
+        return [t for t, message in self.messages if message[0] == CLOCK]
+
+    def close_port(self):
+        pass
+
+
+def open_port(name: str = "", virtual: bool = False):
+    """rtmidi output port whose name contains name, or a new virtual port called name\n
+    Args:
+        name (str): part of the port name, empty for the first port
+        virtual (bool): create a virtual port other programs can connect to (not on Windows)
+    """
+    try:
+        import rtmidi
+    except ImportError:
+        raise RuntimeError("MIDI output needs the python-rtmidi package")
+
+    midi_out = rtmidi.MidiOut()
+    if virtual:
+        midi_out.open_virtual_port(name or "BPMtoOSC")
+        return midi_out
+    for index, port in enumerate(midi_out.get_ports()):
+        if name.lower() in port.lower():
+            midi_out.open_port(index)
+            return midi_out
+    raise RuntimeError(f"No MIDI output port matching '{name}'")
+
+
+class MidiClock:
+    """24 PPQN MIDI clock on absolute deadlines"""
+
+    PPQN = 24
+
+    def __init__(self, port, bpm: float = 120.0, ramp: float = 0.2, spin: float = None):
+        """
+        Args:
+            port: output with send_message(list), e.g. from open_port or a LoopbackPort
+            bpm (float): initial tempo
+            ramp (float): seconds a tempo change takes, 0 for immediate
+            spin (float, optional): seconds busy waited before each pulse, default deadline.SPIN
+        """
+        self.port = port
+        self.ramp = ramp
+        self.spin = spin
+        self._lock = Lock()
+        self._from_bpm = self._to_bpm = float(bpm)
+        self._ramp_start = 0.0
+        self._ramp_time = 0.0
+
+        self.playing = False
+        self.pulses = 0  # pulses since start / song position, 6 per sixteenth
+        self.lateness = LatencyHistogram()  # pulse send time after its deadline
+        self._deadline = None
+
+        self._wake = Event()
+        self._wait = clearing_wait(self._wake)
+        self._active = True
+        self._thread = Thread(target=self._run, name="MidiClock", daemon=True)
+        self._thread.start()
+
+    @property
+    def bpm(self) -> float:
+        return self.tempo_at(perf_counter())
+
+    def tempo_at(self, t: float) -> float:
+        """Tempo at perf_counter() time t, following a running ramp"""
+        with self._lock:
+            if self._ramp_time <= 0 or t >= self._ramp_start + self._ramp_time:
+                return self._to_bpm
+            progress = max(0.0, t - self._ramp_start) / self._ramp_time
+            return self._from_bpm + (self._to_bpm - self._from_bpm) * progress
+
+    def set_bpm(self, bpm: float, ramp: float = None):
+        """Change the tempo, ramping from the current one\n
+        Args:
+            bpm (float): new tempo
+            ramp (float, optional): ramp time in seconds, default self.ramp
+        """
+        now = perf_counter()
+        current = self.tempo_at(now)
+        with self._lock:
+            self._from_bpm = current
+            self._to_bpm = float(bpm)
+            self._ramp_start = now
+            self._ramp_time = self.ramp if ramp is None else ramp
+
+    def start(self):
+        """Start from the beginning (or the last song position)"""
+        self.port.send_message([START])
+        self._deadline = perf_counter()
+        self.playing = True
+        self._wake.set()
+
+    def proceed(self):
+        """Continue from where stop() left off"""
+        self.port.send_message([CONTINUE])
+        self._deadline = perf_counter()
+        self.playing = True
+        self._wake.set()
+
+    def stop(self):
+        self.playing = False
+        self._wake.set()
+        self.port.send_message([STOP])
+
+    def song_position(self, sixteenths: int):
+        """Set the song position, only meaningful while stopped"""
+        sixteenths = max(0, min(sixteenths, 0x3FFF))
+        self.pulses = sixteenths * 6
+        self.port.send_message([SONG_POSITION, sixteenths & 0x7F, sixteenths >> 7])
+
+    def resync(self):
+        """Let the next pulse, a beat start, go out now"""
+        self.pulses -= self.pulses % self.PPQN
+        self._deadline = perf_counter()
+        self._wake.set()
+
+    def _run(self):
+        while self._active:
+            if not self.playing:
+                self._wake.wait(0.5)
+                self._wake.clear()
+                continue
+
+            deadline = self._deadline
+            if not wait_until(deadline, self._wait, self.spin):
+                # started, stopped or resynced meanwhile
+                continue
+            if not (self._active and self.playing) or deadline != self._deadline:
+                continue
+
+            self.port.send_message([CLOCK])
+            late = perf_counter() - deadline
+            self.lateness.record(late)
+            self.pulses += 1
+
+            period = 60.0 / (self.tempo_at(deadline) * self.PPQN)
+            # after a stall of more than a beat, continue on the grid instead of bursting the missed pulses
+            self._deadline = deadline + (missed(late, period, self.PPQN * period) + 1) * period
+
+    def report(self) -> str:
+        return (f"MIDI clock {self.bpm:.2f} BPM, {self.pulses} pulses, lateness p50 "
+                f"{self.lateness.percentile(50) * 1e6:.0f}us p99 {self.lateness.percentile(99) * 1e6:.0f}us "
+                f"max {self.lateness.max * 1e6:.0f}us")
+
+    def close(self):
+        if self.playing:
+            self.stop()
+        self._active = False
+        self._wake.set()
+        self._thread.join()
+        self.port.close_port()
+
+
+class ClockFollower(ClientWrapper):
+    """Passes OSC through to a client and sets the MidiClock tempo from the sent BPM"""
+
+    def __init__(self, client, clock: MidiClock, bpm_address: str, resync_address: str):
+        self.client = client
+        self.clock = clock
+        self.bpm_address = bpm_address
+        self.resync_address = resync_address
+
+    def _follow(self, osc_address: str, value, map_to_resolume):
+        if osc_address == self.bpm_address and map_to_resolume:
+            self.clock.set_bpm(value)
+        elif osc_address == self.resync_address:
+            self.clock.resync()
+
+    def send_osc(self, osc_address: str, value, map_to_resolume=False) -> None:
+        self._follow(osc_address, value, map_to_resolume)
+        self.client.send_osc(osc_address, value, map_to_resolume=map_to_resolume)
+
+    def send_bundle(self, messages: list, timetag: float = None) -> None:
+        for message in messages:
+            self._follow(*message)
+        self.client.send_bundle(messages, timetag)
+
+    def stats(self) -> str:
+        client = self.client.stats() if hasattr(self.client, 'stats') else ""
+        return f"{client}; {self.clock.report()}"
+
+    def close(self):
+        self.clock.close()
+        if hasattr(self.client, 'close'):
+            self.client.close()
+
+
+def benchmark(seconds: float = 5.0, bpm: float = 128.0, spin: float = None) -> dict:
+    """Pulse timing against a LoopbackPort\n
+    The result depends on the machine: the busy wait only pays off with a core to spare,
+    on a single core the OS scheduler dominates the jitter.
+
+    Args:
+        seconds (float): length of the steady part, followed by a one second ramp to bpm + 10
+        bpm (float): steady tempo
+        spin (float, optional): seconds busy waited before each pulse, default deadline.SPIN
+    Returns:
+        dict: interval jitter, drift after the steady part and lateness, in ms
+    """
+    import math
+
+    port = LoopbackPort()
+    clock = MidiClock(port, bpm, ramp=1.0, spin=spin)
+    clock.start()
+    sleep(seconds)
+    steady = port.clock_times()
+    clock.set_bpm(bpm + 10)
+    sleep(1.5)
+    clock.close()
+
+    period = 60.0 / (bpm * MidiClock.PPQN)
+    errors = [b - a - period for a, b in zip(steady, steady[1:])]
+    mean = sum(errors) / len(errors)
+    jitter = math.sqrt(sum((e - mean) ** 2 for e in errors) / len(errors))
+    drift = steady[-1] - steady[0] - (len(steady) - 1) * period
+
+    ramp = port.clock_times()[len(steady):]
+    final_period = sorted(b - a for a, b in zip(ramp[-25:], ramp[-24:]))[12]
+    return {"pulses": len(steady), "interval_ms": round(period * 1000, 4),
+            "jitter_ms": round(jitter * 1000, 4), "max_error_ms": round(max(map(abs, errors)) * 1000, 4),
+            "drift_ms": round(drift * 1000, 4),
+            "lateness_p99_ms": round(clock.lateness.percentile(99) * 1000, 4),
+            "bpm_after_ramp": round(60.0 / (final_period * MidiClock.PPQN), 2)}
+
+
+if __name__ == "__main__":
+    print(benchmark())
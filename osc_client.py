@@ -1,15 +1,103 @@
-from pythonosc.udp_client import SimpleUDPClient
+import asyncio
+import socket
+import struct
+from collections import OrderedDict
+from threading import Thread, Lock
+
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+
+NTP_DELTA = 2208988800  # seconds from the NTP epoch (1900) to the unix epoch
+IMMEDIATELY = struct.pack(">Q", 1)  # OSC timetag meaning "on arrival"
+
+
+def ntp_timetag(seconds: float = None) -> bytes:
+    """OSC timetag for a unix time (time.time() seconds), None for immediately"""
+    if seconds is None:
+        return IMMEDIATELY
+    seconds += NTP_DELTA
+    whole = int(seconds)
+    return struct.pack(">II", whole, int((seconds - whole) * 4294967296) & 0xFFFFFFFF)
+
+
+def encode_bundle(dgrams: list, timetag: bytes = IMMEDIATELY) -> bytes:
+    """OSC bundle of already encoded messages\n
+    Args:
+        dgrams (list): encoded OSC messages, e.g. from DatagramCache.get
+        timetag (bytes): from ntp_timetag
+    """
+    return b"#bundle\x00" + timetag + b"".join(struct.pack(">i", len(d)) + d for d in dgrams)
+
+
+def resolume_value(value):
+    """BPM mapped to Resolume's 0..1 tempo range (20..500 BPM), None outside of it"""
+    if value > 20 and value < 500:
+        return float(value - 20) / float(480)
+    return None
+
+
+class DatagramCache:
+    """Bounded LRU cache of encoded OSC messages keyed by address and value\n
+    BPM values and addresses come from a small fixed set, so after warming up
+    nearly every send is a dictionary lookup instead of building an OscMessage.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, osc_address: str, value) -> bytes:
+        # the type is part of the key, 1 and 1.0 hash equal but encode differently
+        key = (osc_address, type(value), value)
+        dgram = self._cache.get(key)
+        if dgram is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return dgram
+
+        self.misses += 1
+        builder = OscMessageBuilder(address=osc_address)
+        if value is not None:
+            builder.add_arg(value)
+        dgram = builder.build().dgram
+        self._cache[key] = dgram
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+        return dgram
+
+    def clear(self):
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
 
 
 class OSCclient():
 
-    def __init__(self, ip: str, port: int):
+    def __init__(self, ip: str, port: int, cache_size: int = 1024):
         self.__ip = ip.replace(" ", "")
         self.__port = port
 
-        self.__osc_client = SimpleUDPClient(self.ip, self.port)
+        self.cache = DatagramCache(cache_size)
+        self.sent = 0
+        self.errors = 0  # sends the OS refused, e.g. full socket buffer
+        self.__sock = None
+        self.__connect()
         #self.__map = interp1d([20, 500], [0, 1])
 
+    def __connect(self):
+        """Resolve the target once and (re)create the socket if the address family changed"""
+        family, _, _, _, self.__sockaddr = socket.getaddrinfo(self.ip, self.port, type=socket.SOCK_DGRAM)[0]
+        if self.__sock is None or self.__sock.family != family:
+            if self.__sock is not None:
+                self.__sock.close()
+            self.__sock = socket.socket(family, socket.SOCK_DGRAM)
+            self.__sock.setblocking(False)
+
     @property
     def ip(self):
         return self.__ip
@@ -21,7 +109,7 @@ class OSCclient():
     @ip.setter
     def ip(self, ip: str):
         self.__ip = ip
-        self.__osc_client = SimpleUDPClient(self.ip, self.port)
+        self.__connect()
 
     @property
     def port(self):
@@ -34,14 +122,327 @@ class OSCclient():
     @port.setter
     def port(self, port: int):
         self.__port = port
-        self.__osc_client = SimpleUDPClient(self.ip, self.port)
+        self.__connect()
 
     def send_osc(self, osc_address: str, value, map_to_resolume=False) -> None:
         if map_to_resolume:
-            if value > 20 and value < 500:
-                self.__osc_client.send_message(osc_address, float(value - 20) / float(480))
+            value = resolume_value(value)
+            if value is not None:
+                self.send_dgram(self.cache.get(osc_address, value))
         else:
-            self.__osc_client.send_message(osc_address, value)
+            self.send_dgram(self.cache.get(osc_address, value))
+
+    def send_bundle(self, messages: list, timetag: float = None) -> None:
+        """Send several messages as one timetagged OSC bundle\n
+        Args:
+            messages (list): (osc_address, value, map_to_resolume) tuples
+            timetag (float, optional): unix time the receiver should apply the bundle at, None for immediately
+        """
+        dgrams = []
+        for osc_address, value, map_to_resolume in messages:
+            if map_to_resolume:
+                value = resolume_value(value)
+                if value is None:
+                    continue
+            dgrams.append(self.cache.get(osc_address, value))
+        if dgrams:
+            self.send_dgram(encode_bundle(dgrams, ntp_timetag(timetag)))
+
+    def send_dgram(self, dgram: bytes) -> None:
+        """Send an encoded OSC packet, a single sendto on the reused socket"""
+        try:
+            self.__sock.sendto(dgram, self.__sockaddr)
+            self.sent += 1
+        except OSError:
+            self.errors += 1
 
     def __del__(self):
-        del self.__osc_client
+        if self.__sock is not None:
+            self.__sock.close()
+
+
+class OSCTarget:
+    """One receiver of an OSCFanout with its own address map and value mapping"""
+
+    # mappings for values sent with map_to_resolume
+    MAPPINGS = ("resolume", "bpm", "range")
+
+    def __init__(self, name: str, ip: str, port: int, addresses: dict = None, mapping: str = "resolume",
+                 value_range: tuple = (20, 500)):
+        """
+        Args:
+            name (str): label for statistics
+            ip (str): receiver ip or hostname, resolved once here
+            port (int): receiver port
+            addresses (dict, optional): our OSC address -> address this receiver expects, missing ones are kept
+            mapping (str): "resolume" (20..500 BPM to 0..1), "bpm" (plain float) or "range" (value_range to 0..1)
+            value_range (tuple): BPM range for the "range" mapping
+        """
+        if mapping not in self.MAPPINGS:
+            raise ValueError(f"Unknown mapping '{mapping}', use one of {self.MAPPINGS}")
+        self.name = name
+        self.ip = ip.replace(" ", "")
+        self.port = port
+        self.addresses = addresses or {}
+        self.mapping = mapping
+        self.value_range = (20, 500) if mapping == "resolume" else value_range
+        self.family, _, _, _, self.sockaddr = socket.getaddrinfo(self.ip, port, type=socket.SOCK_DGRAM)[0]
+        self.sent = 0
+        self.errors = 0
+
+    def map_value(self, value):
+        """Mapped BPM value or None if it is outside the range of the receiver"""
+        if self.mapping == "bpm":
+            return float(value)
+        low, high = self.value_range
+        if value > low and value < high:
+            return float(value - low) / float(high - low)
+        return None
+
+
+class OSCFanout:
+    """Sends every message to a list of OSCTargets from one socket\n
+    Drop-in for OSCclient. Messages are encoded once per distinct (address, value)
+    through the shared DatagramCache, targets can be swapped while sending.
+    """
+
+    def __init__(self, targets: list, cache_size: int = 1024):
+        self.cache = DatagramCache(cache_size)
+        self.__socks = {}  # one socket per address family
+        self.__targets = ()
+        self.set_targets(targets)
+
+    @property
+    def targets(self) -> tuple:
+        return self.__targets
+
+    def set_targets(self, targets: list) -> None:
+        """Replace the targets, safe while another thread is sending"""
+        for target in targets:
+            if target.family not in self.__socks:
+                sock = socket.socket(target.family, socket.SOCK_DGRAM)
+                sock.setblocking(False)
+                self.__socks[target.family] = sock
+        # swapped as a whole, a running send_osc keeps using the old tuple
+        self.__targets = tuple(targets)
+
+    def send_osc(self, osc_address: str, value, map_to_resolume=False) -> None:
+        for target in self.__targets:
+            mapped = target.map_value(value) if map_to_resolume else value
+            if mapped is None:
+                continue
+            self._send(target, self.cache.get(target.addresses.get(osc_address, osc_address), mapped))
+
+    def send_bundle(self, messages: list, timetag: float = None) -> None:
+        """Send several messages as one timetagged OSC bundle to every target\n
+        Args:
+            messages (list): (osc_address, value, map_to_resolume) tuples
+            timetag (float, optional): unix time the receivers should apply the bundle at, None for immediately
+        """
+        tag = ntp_timetag(timetag)
+        for target in self.__targets:
+            dgrams = []
+            for osc_address, value, map_to_resolume in messages:
+                mapped = target.map_value(value) if map_to_resolume else value
+                if mapped is not None:
+                    dgrams.append(self.cache.get(target.addresses.get(osc_address, osc_address), mapped))
+            if dgrams:
+                self._send(target, encode_bundle(dgrams, tag))
+
+    def _send(self, target: OSCTarget, dgram: bytes):
+        try:
+            self.__socks[target.family].sendto(dgram, target.sockaddr)
+            target.sent += 1
+        except OSError:
+            target.errors += 1
+
+    def stats(self) -> str:
+        return ", ".join(f"{t.name} ({t.ip}:{t.port}) sent {t.sent} errors {t.errors}" for t in self.__targets)
+
+    def __del__(self):
+        for sock in self.__socks.values():
+            sock.close()
+
+
+class ClientWrapper:
+    """Base of the classes wrapping an OSC client in self.client\n
+    Attributes the wrapper does not have itself (targets, set_targets, cache, ...) come from
+    the wrapped client.
+    """
+
+    def __getattr__(self, name):
+        if name == 'client' or name.startswith('_'):
+            # no client yet, e.g. a failing __init__ or unpickling, would recurse forever
+            raise AttributeError(name)
+        return getattr(self.client, name)
+
+
+class AsyncOSCTransport(ClientWrapper):
+    """Sends through a client on its own asyncio event loop thread\n
+    send_osc only puts the message into a small bounded queue and returns, so the
+    audio and scheduler threads never wait for encoding or the socket. Messages to
+    the same address coalesce, a newer BPM replaces one that is still pending (a
+    bundle only replaces one with the same addresses); when the queue is full the
+    oldest pending message is dropped. Hostnames are resolved when the client /
+    targets are created, never on the loop.
+    """
+
+    def __init__(self, client, maxsize: int = 32):
+        """
+        Args:
+            client (OSCclient | OSCFanout): does the actual sending
+            maxsize (int): pending messages (distinct addresses) before dropping
+        """
+        self.client = client
+        self.maxsize = maxsize
+        self._pending = OrderedDict()  # osc address (bundles: their addresses) -> (send function, arguments)
+        self._lock = Lock()
+        self._scheduled = False  # a drain is queued on the loop
+
+        self.enqueued = 0
+        self.coalesced = 0  # replaced by a newer value before sending
+        self.dropped = 0  # pushed out of a full queue
+        self.max_depth = 0
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._loop.run_forever, name="OSC-transport", daemon=True)
+        self._thread.start()
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def send_osc(self, osc_address: str, value, map_to_resolume=False) -> None:
+        self._enqueue(osc_address, self.client.send_osc, (osc_address, value, map_to_resolume))
+
+    def send_bundle(self, messages: list, timetag: float = None) -> None:
+        # a newer bundle only replaces a pending one with the same addresses, so a beat-only
+        # bundle never takes the place of one carrying a tempo
+        key = ("#bundle",) + tuple(osc_address for osc_address, _, _ in messages)
+        self._enqueue(key, self.client.send_bundle, (messages, timetag))
+
+    def _enqueue(self, key, send, args: tuple):
+        with self._lock:
+            if key in self._pending:
+                self.coalesced += 1
+            elif len(self._pending) >= self.maxsize:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+            self._pending[key] = (send, args)
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self._pending))
+            if self._scheduled:
+                return
+            self._scheduled = True
+        try:
+            self._loop.call_soon_threadsafe(self._drain)
+        except RuntimeError:
+            # loop already closed
+            pass
+
+    def _drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+            self._scheduled = False
+        for send, args in pending.values():
+            send(*args)
+
+    def stats(self) -> str:
+        client = self.client.stats() if hasattr(self.client, 'stats') else f"sent {self.client.sent} errors {self.client.errors}"
+        return (f"{client}; queue depth {self.depth} (max {self.max_depth}), enqueued {self.enqueued}, "
+                f"coalesced {self.coalesced}, dropped {self.dropped}")
+
+    def close(self):
+        """Send what is still pending and stop the loop thread"""
+        if self._loop.is_closed():
+            return
+        # runs after an already queued drain
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+def benchmark(messages: int = 100000) -> dict:
+    """Compare the cached raw socket path and the queued transport with SimpleUDPClient.send_message\n
+    Sends Resolume mapped BPM values to a local socket that never reads.
+
+    Args:
+        messages (int): messages per path
+    Returns:
+        dict: messages per second and p50 / p99 latency per send in microseconds for each path
+    """
+    from time import perf_counter
+    from pythonosc.udp_client import SimpleUDPClient
+
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    port = sink.getsockname()[1]
+    address = "/composition/tempocontroller/tempo"
+    values = [float(bpm - 20) / 480 for bpm in range(21, 500)]
+
+    def run(send):
+        durations = []
+        start = perf_counter()
+        for i in range(messages):
+            t0 = perf_counter()
+            send(values[i % len(values)])
+            durations.append(perf_counter() - t0)
+        elapsed = perf_counter() - start
+        durations.sort()
+        return {"messages_per_s": round(messages / elapsed),
+                "p50_us": round(durations[len(durations) // 2] * 1e6, 2),
+                "p99_us": round(durations[int(len(durations) * 0.99)] * 1e6, 2)}
+
+    simple = SimpleUDPClient("127.0.0.1", port)
+    client = OSCclient("127.0.0.1", port)
+    transport = AsyncOSCTransport(OSCclient("127.0.0.1", port))
+    result = {"send_message": run(lambda v: simple.send_message(address, v)),
+              "cached": run(lambda v: client.send_osc(address, v)),
+              "queued": run(lambda v: transport.send_osc(address, v))}
+    transport.close()
+    result["cached"]["errors"] = client.errors
+    result["queued"]["coalesced"] = transport.coalesced
+    sink.close()
+    return result
+
+
+def bundle_roundtrip(lead: float = 0.05) -> dict:
+    """Self check: send a timetagged beat bundle to a local receiver and parse it back\n
+    Args:
+        lead (float): seconds in the future the bundle is stamped with
+    Returns:
+        dict: received messages, timetag error and how early the bundle arrived, in ms
+    """
+    from time import time
+    from pythonosc.osc_bundle import OscBundle
+
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(1)
+    client = OSCclient("127.0.0.1", receiver.getsockname()[1])
+
+    beat_time = time() + lead
+    client.send_bundle([("/composition/tempocontroller/tempo", 128, True),
+                        ("/bpmtoosc/beat", 0, False),
+                        ("/composition/tempocontroller/resync", 1, False)], beat_time)
+    dgram = receiver.recv(1024)
+    arrival = time()
+    receiver.close()
+
+    bundle = OscBundle(dgram)
+    messages = [(m.address, m.params) for m in bundle]
+    tempo = struct.unpack(">f", struct.pack(">f", (128 - 20) / 480))[0]  # OSC floats are 32 bit
+    assert messages == [("/composition/tempocontroller/tempo", [tempo]),
+                        ("/bpmtoosc/beat", [0]),
+                        ("/composition/tempocontroller/resync", [1])], messages
+    # NTP fractions have a resolution of 233ps, the float conversion limits it to about a microsecond
+    error = bundle.timestamp - beat_time
+    assert abs(error) < 1e-5, error
+    return {"messages": messages, "timetag_error_ms": round(error * 1000, 6),
+            "early_ms": round((beat_time - arrival) * 1000, 3)}
+
+
+if __name__ == "__main__":
+    print(f"bundle round trip: {bundle_roundtrip()}")
+    for path, numbers in benchmark().items():
+        print(f"{path:12s} {numbers}")
@@ -0,0 +1,128 @@
+"""Non-blocking reachability probe for the OSC target
+
+Instead of an ICMP ping on the GUI thread, ReachabilityProbe sends small
+OSC query packets to the target's UDP port from a worker thread:
+    reachable   the target answered (receivers that echo or answer queries), RTT measured
+    refused     the host answered with "port unreachable", nothing listens on the port
+    no reply    nothing came back, which is normal for receivers that never answer
+    unresolved  the hostname could not be resolved
+Results are cached per target for a TTL and the RTT history gives
+statistics that can feed the latency compensation of the scheduler.
+"""
+import socket
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from time import perf_counter
+
+from osc_client import DatagramCache
+
+PROBE_ADDRESS = "/bpmtoosc/ping"
+
+
+class ProbeResult(namedtuple("ProbeResult", "state rtts")):
+    """state of the target and the measured round trip times in seconds"""
+
+    @property
+    def rtt(self) -> float:
+        """Median round trip time, None if nothing answered"""
+        if not self.rtts:
+            return None
+        return sorted(self.rtts)[len(self.rtts) // 2]
+
+    def __str__(self) -> str:
+        if self.state == "reachable":
+            return f"Reachable {self.rtt * 1000:.1f}ms"
+        return {"refused": "Port closed", "no reply": "No reply", "unresolved": "Unresolved"}[self.state]
+
+
+class ReachabilityProbe:
+    """Probes OSC targets on a worker thread and caches the results"""
+
+    def __init__(self, ttl: float = 5.0, count: int = 3, timeout: float = 0.3, history: int = 100):
+        """
+        Args:
+            ttl (float): seconds a result is reused
+            count (int): query packets per probe
+            timeout (float): seconds to wait for each answer
+            history (int): RTTs kept per target for rtt_stats
+        """
+        self.ttl = ttl
+        self.count = count
+        self.timeout = timeout
+        self._cache = {}  # (ip, port) -> (perf_counter() of the probe, ProbeResult)
+        self._history = {}  # (ip, port) -> deque of RTTs
+        self._history_size = history
+        self._lock = Lock()
+        self._pool = ThreadPoolExecutor(1, "ReachabilityProbe")
+
+    def probe(self, ip: str, port: int, force: bool = False) -> Future:
+        """Start probing, returns immediately\n
+        Args:
+            ip (str): target ip or hostname
+            port (int): target UDP port
+            force (bool): probe even if a cached result is still valid
+        Returns:
+            Future: resolves to a ProbeResult, use add_done_callback to get it
+        """
+        key = (ip.replace(" ", ""), int(port))
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None and not force and perf_counter() - cached[0] < self.ttl:
+            future = Future()
+            future.set_result(cached[1])
+            return future
+        return self._pool.submit(self._probe, key)
+
+    def _probe(self, key: tuple) -> ProbeResult:
+        try:
+            family, _, _, _, sockaddr = socket.getaddrinfo(key[0], key[1], type=socket.SOCK_DGRAM)[0]
+        except socket.gaierror:
+            return self._store(key, ProbeResult("unresolved", ()))
+
+        rtts = []
+        state = "no reply"
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            # connected, so an ICMP port unreachable shows up as an error on recv
+            sock.connect(sockaddr)
+            sock.settimeout(self.timeout)
+            cache = DatagramCache(self.count)
+            for sequence in range(self.count):
+                start = perf_counter()
+                try:
+                    sock.send(cache.get(PROBE_ADDRESS, sequence))
+                    sock.recv(4096)
+                except socket.timeout:
+                    continue
+                except (ConnectionRefusedError, ConnectionResetError):
+                    # Windows reports the ICMP answer as a reset
+                    state = "refused"
+                    break
+                except OSError:
+                    # e.g. no route to the host
+                    break
+                rtts.append(perf_counter() - start)
+                state = "reachable"
+        finally:
+            sock.close()
+        return self._store(key, ProbeResult(state, tuple(rtts)))
+
+    def _store(self, key: tuple, result: ProbeResult) -> ProbeResult:
+        with self._lock:
+            self._cache[key] = (perf_counter(), result)
+            self._history.setdefault(key, deque(maxlen=self._history_size)).extend(result.rtts)
+        return result
+
+    def rtt_stats(self, ip: str, port: int) -> dict:
+        """Round trip time statistics of all probes of a target, in ms"""
+        with self._lock:
+            rtts = sorted(self._history.get((ip.replace(" ", ""), int(port)), ()))
+        if not rtts:
+            return {"count": 0}
+        return {"count": len(rtts), "min_ms": round(rtts[0] * 1000, 3),
+                "median_ms": round(rtts[len(rtts) // 2] * 1000, 3),
+                "p95_ms": round(rtts[int(len(rtts) * 0.95)] * 1000, 3), "max_ms": round(rtts[-1] * 1000, 3)}
+
+    def close(self):
+        self._pool.shutdown(wait=False)
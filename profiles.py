@@ -0,0 +1,170 @@
+"""Named latency profiles for the beat detection
+
+A profile picks the sample rate, aubio hop / window size, onset method and
+driver buffer size. The profiles run at the rates audio interfaces actually
+offer (44.1 / 48 kHz); the session falls back to the device's own rate if
+it rejects the one of the profile. The profiles live in lastsession.ini as [PROFILE:<name>]
+sections so they can be tuned per rig, together with the numbers measured
+by the built-in benchmark.
+
+Usage:
+    python profiles.py            # benchmark all profiles
+    python profiles.py --save     # ... and store the results in lastsession.ini
+"""
+import argparse
+import configparser
+from pathlib import Path
+from time import process_time
+
+
+DEFAULT_PROFILE = "balanced"
+
+# keys match the BeatDetector keyword arguments,
+# ensemble lists extra onset methods to fuse with onset_method (e.g. "hfc,complex")
+PROFILES = {
+    "low-latency": {"samplerate": 44100, "buf_size": 128, "win_size": 256,
+                    "onset_method": "default", "frames_per_buffer": 128, "ensemble": ""},
+    "balanced": {"samplerate": 44100, "buf_size": 256, "win_size": 512,
+                 "onset_method": "default", "frames_per_buffer": 1024, "ensemble": ""},
+    "balanced-48k": {"samplerate": 48000, "buf_size": 256, "win_size": 512,
+                     "onset_method": "default", "frames_per_buffer": 1024, "ensemble": ""},
+    # fewer, larger hops instead of a lower sample rate, which many interfaces reject
+    "low-CPU": {"samplerate": 44100, "buf_size": 512, "win_size": 1024,
+                "onset_method": "specflux", "frames_per_buffer": 2048, "ensemble": ""},
+}
+
+_INT_KEYS = ("samplerate", "buf_size", "win_size", "frames_per_buffer")
+_SECTION = "PROFILE:"
+
+
+def ensure_profiles(config: configparser.ConfigParser) -> None:
+    """Add missing profile sections and the selected profile to a config"""
+    for name, values in PROFILES.items():
+        section = _SECTION + name
+        if not config.has_section(section):
+            config[section] = {key: str(value) for key, value in values.items()}
+    if not config.has_section('AUDIO'):
+        config['AUDIO'] = {}
+    config['AUDIO'].setdefault('profile', DEFAULT_PROFILE)
+
+
+def profile_names(config: configparser.ConfigParser) -> list:
+    return [s[len(_SECTION):] for s in config.sections() if s.startswith(_SECTION)]
+
+
+def get_profile(config: configparser.ConfigParser, name: str = None) -> dict:
+    """BeatDetector keyword arguments of a profile\n
+    Args:
+        config (ConfigParser): session config
+        name (str, optional): profile name, defaults to the selected one
+    Returns:
+        dict: samplerate, buf_size, win_size, onset_method, frames_per_buffer and ensemble
+    """
+    name = name or config['AUDIO'].get('profile', DEFAULT_PROFILE)
+    section = config[_SECTION + name] if config.has_section(_SECTION + name) else {}
+    profile = dict(PROFILES.get(name, PROFILES[DEFAULT_PROFILE]))
+    for key in profile:
+        if key in section:
+            profile[key] = int(section[key]) if key in _INT_KEYS else section[key]
+    return profile
+
+
+def describe(config: configparser.ConfigParser, name: str) -> str:
+    """Profile name with its benchmark numbers if they were measured"""
+    section = config[_SECTION + name]
+    if 'cpu_per_second' in section and 'latency_ms' in section:
+        return f"{name} ({float(section['cpu_per_second']) * 1000:.0f}ms CPU/s, {section['latency_ms']}ms)"
+    return name
+
+
+def click_track(samplerate: int, seconds: float, bpm: float = 128.0) -> tuple:
+    """Synthetic click track\n
+    Returns:
+        (np.ndarray, np.ndarray): float32 signal and the frame index of every click
+    """
+    import numpy as np
+
+    signal = np.zeros(int(samplerate * seconds), dtype=np.float32)
+    clicks = np.arange(0, signal.size, samplerate * 60.0 / bpm).astype(np.int64)
+    length = samplerate // 100  # 10ms decaying noise burst
+    burst = np.random.default_rng(0).uniform(-1, 1, length) * np.exp(-np.linspace(0, 8, length))
+    for click in clicks:
+        end = min(click + length, signal.size)
+        signal[click:end] = burst[:end - click]
+    return signal, clicks
+
+
+def benchmark_profile(profile: dict, seconds: float = 60.0, bpm: float = 128.0) -> dict:
+    """Run the tracker of a profile over a click track\n
+    Args:
+        profile (dict): see get_profile
+        seconds (float): length of the click track
+        bpm (float): tempo of the click track
+    Returns:
+        dict: cpu_per_second (CPU seconds per second of audio), latency_ms (median time from a
+              click until the beat is reported, including the driver buffer) and the detected bpm
+    """
+    import numpy as np
+    from ensemble import create_tempo
+
+    samplerate, hop = profile['samplerate'], profile['buf_size']
+    signal, clicks = click_track(samplerate, seconds, bpm)
+    tracker = create_tempo(profile['onset_method'], profile['win_size'], hop, samplerate, profile['ensemble'])
+
+    decisions = []
+    start = process_time()
+    for pos in range(0, signal.size - hop + 1, hop):
+        if tracker(signal[pos:pos + hop])[0]:
+            decisions.append(pos + hop)
+    cpu = process_time() - start
+
+    # skip the first seconds the tracker needs to lock
+    decisions = np.array([d for d in decisions if d > 5 * samplerate], dtype=np.int64)
+    if decisions.size:
+        # closest click on either side, the tracker may also report a beat slightly early
+        idx = np.clip(np.searchsorted(clicks, decisions), 1, clicks.size - 1)
+        offsets = np.where(decisions - clicks[idx - 1] < clicks[idx] - decisions,
+                           decisions - clicks[idx - 1], decisions - clicks[idx])
+        latency = np.median(offsets) / samplerate
+    else:
+        latency = float('nan')
+    # the driver buffer has to be full before the hop is even seen
+    latency += profile['frames_per_buffer'] / samplerate
+
+    return {'cpu_per_second': cpu / seconds,
+            'latency_ms': round(float(latency) * 1000, 1),
+            'bpm': round(tracker.get_bpm(), 1)}
+
+
+def main(argv=None):
+    from session import CONF_PATH
+
+    parser = argparse.ArgumentParser(description="Benchmark the latency profiles")
+    parser.add_argument("--ini", default=CONF_PATH, type=Path, help="session file (default: %(default)s)")
+    parser.add_argument("--seconds", type=float, default=60.0, help="length of the click track")
+    parser.add_argument("--save", action="store_true", help="store the results in the session file")
+    args = parser.parse_args(argv)
+
+    config = configparser.ConfigParser()
+    config.read(args.ini)
+    ensure_profiles(config)
+
+    for name in profile_names(config):
+        profile = get_profile(config, name)
+        result = benchmark_profile(profile, args.seconds)
+        config[_SECTION + name]['cpu_per_second'] = f"{result['cpu_per_second']:.5f}"
+        config[_SECTION + name]['latency_ms'] = str(result['latency_ms'])
+        methods = ",".join(filter(None, (profile['onset_method'], profile['ensemble'])))
+        print(f"{name:12s} {profile['samplerate']}Hz hop {profile['buf_size']} win {profile['win_size']} "
+              f"{methods:8s} buffer {profile['frames_per_buffer']:5d}: "
+              f"{result['cpu_per_second'] * 1000:6.2f}ms CPU/s, latency {result['latency_ms']}ms, "
+              f"{result['bpm']} BPM")
+
+    if args.save:
+        args.ini.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.ini, 'w') as configfile:
+            config.write(configfile)
+
+
+if __name__ == "__main__":
+    main()
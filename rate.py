@@ -0,0 +1,118 @@
+"""Rate ratio between the detected and the sent tempo
+
+The sent tempo is the detected one times a ratio such as 1/2 (half time) or
+3/2 (triplet feel), kept as a Fraction so the sent BPM is exact and
+fractional where needed (128 * 2/3 = 85.33). The same ratio decides which
+detected beats carry a sent beat: gate() counts the sent beats falling on
+each detected beat, and output_beat() tells where a detected beat lies in
+the sent bar, so LEDs and bar cues follow the sent tempo and not the
+detected one.
+
+A sent tempo outside the receiver's range is folded back by octaves (4 x 130
+goes out as 260, i.e. at 2). follow() keeps the effective ratio for the
+current tempo, and the beat gate and bar follow that ratio, not the chosen
+one.
+"""
+import math
+from fractions import Fraction
+
+RATIOS = ("1/4", "1/2", "2/3", "1", "3/2", "2", "4")  # offered in the GUI
+MIN_BPM, MAX_BPM = 20, 500  # Resolume's tempo range, exclusive
+
+
+def parse_ratio(value) -> Fraction:
+    """Fraction from e.g. "3/2", "1.5", 2 or 0.5\n
+    Raises:
+        ValueError: not a positive number
+    """
+    try:
+        ratio = Fraction(str(value).strip()).limit_denominator(16)
+    except ZeroDivisionError:
+        raise ValueError(f"Rate ratio has to be positive, got {value}")
+    if ratio <= 0:
+        raise ValueError(f"Rate ratio has to be positive, got {value}")
+    return ratio
+
+
+class RateRatio:
+    """Scales the tempo and gates beats by a ratio"""
+
+    def __init__(self, ratio=1, beats_per_bar: int = 4):
+        """
+        Args:
+            ratio (int | float | str | Fraction): sent beats per detected beat
+            beats_per_bar (int): beats of a bar of the sent tempo
+        """
+        self.beats_per_bar = beats_per_bar
+        self.set(ratio)
+
+    def set(self, ratio):
+        """Change the ratio, the next detected beat carries a sent beat so the new tempo goes out right away"""
+        self.ratio = parse_ratio(ratio)
+        self.effective = self.ratio  # ratio actually sent, see follow()
+        self._n = 0  # the next detected beat counted from the last downbeat, wrapped at cycle
+
+    def _fold(self, bpm) -> Fraction:
+        """Ratio times the power of two that keeps the sent tempo in MIN_BPM..MAX_BPM"""
+        ratio = self.ratio
+        while bpm * ratio >= MAX_BPM:
+            ratio /= 2
+        while 0 < bpm * ratio <= MIN_BPM:
+            ratio *= 2
+        return ratio
+
+    def follow(self, bpm) -> bool:
+        """Call with every detected tempo before gate()\n
+        Returns:
+            bool: True if the effective ratio changed, the beat gate starts over then
+        """
+        effective = self._fold(bpm)
+        if effective == self.effective:
+            return False
+        self.effective = effective
+        self._n = 0
+        return True
+
+    def reset(self):
+        """Restart the beat gate at a downbeat that just happened, e.g. a bar resync"""
+        self._n = 1 % self.cycle
+
+    @property
+    def cycle(self) -> int:
+        """Detected beats after which both grids meet again on a downbeat of the sent bar"""
+        p, q = self.effective.numerator, self.effective.denominator
+        return self.beats_per_bar * q // math.gcd(p, self.beats_per_bar * q)
+
+    def apply(self, bpm) -> float:
+        """The sent tempo for a detected tempo, int when it is whole\n
+        A result outside MIN_BPM..MAX_BPM is folded back by octaves (e.g. 4 * 130 is sent as 260),
+        the receiver would drop it otherwise.
+        """
+        value = Fraction(bpm) * self._fold(bpm)
+        return int(value) if value.denominator == 1 else round(float(value), 2)
+
+    def gate(self) -> int:
+        """Call on every detected beat\n
+        Returns:
+            int: sent beats due since the previous detected beat, 0 if this one carries none
+        """
+        n = self._n
+        self._n = (n + 1) % self.cycle
+        return math.floor(n * self.effective) - math.floor((n - 1) * self.effective)
+
+    def output_beat(self, source_beat: int) -> int:
+        """Position in the sent bar of a detected beat\n
+        Args:
+            source_beat (int): detected beat counted from a common downbeat, e.g. modulo cycle
+        Returns:
+            int: sent beat in its bar, None if no sent beat lands on this detected beat
+        """
+        position = source_beat * self.effective
+        if position.denominator != 1:
+            return None
+        return int(position) % self.beats_per_bar
+
+    def __str__(self) -> str:
+        if self.effective != self.ratio:
+            return f"{self.ratio} (sent as {self.effective})"
+        return str(self.ratio)
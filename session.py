@@ -0,0 +1,434 @@
+"""Session state and send logic shared by the GUI and the headless service
+
+Nothing in here imports wx. The audio and OSC modules are only imported when
+a stream is started, so the headless service comes up quickly.
+"""
+import configparser
+from os import remove
+from pathlib import Path
+import deadline
+import profiles
+from instrumentation import Instrumentation
+from rate import RateRatio
+from stabiliser import BpmStabiliser
+from taptempo import TapTempo
+from tempoclock import TempoClock
+
+
+CONF_PATH = Path(Path.home(), "AppData/Roaming/BPMtoOSC/lastsession.ini")
+
+
+class BpmSession:
+    """State the BeatDetector talks to (its parent) and the logic around it\n
+    The GUI overrides the display hooks (update_bpm_display, next_led, sync_changed),
+    by default they do nothing.
+    """
+    CONF_PATH = CONF_PATH
+
+    def __init__(self):
+        # Config Setup
+        self.config = configparser.ConfigParser()
+
+        # OSC Setup
+        self.osc_client = None
+
+        # BPM Setup
+        self.beatfinder = None  # audio analysis instance
+        # manual send timer, ticks while sync is off and the stream runs
+        self.tempo_clock = TempoClock(self._no_sync_beat, 128)
+        self.send_bpm = 128  # sent bpm when sync is diasabled (used to hold last live or tap value)
+        self._no_sync_sent = None  # last send bpm the tempo clock sent
+        self.live_bpm = None  # last detected bpm, set by the BeatDetector
+        self.rate = RateRatio()  # sent beats per detected beat, 1/2 is half time
+        self.control_server = None  # incoming OSC remote control
+        self.network_latency = 0.0  # one way, half the probed round trip time
+
+        # Flags
+        self.sync = True  # sync live bpm to send bpm
+        self.running = False
+        self.retrys = 3
+
+        self.Read_LastSession_ini()
+        deadline.set_spin(self.config.getfloat('SCHEDULER', 'spin_ms', fallback=2) / 1000)
+
+        # tap tempo, see [TAP] in lastsession.ini
+        self.tap_tempo = TapTempo(self.config.getint('TAP', 'window', fallback=12),
+                                  self.config.getint('TAP', 'timeout_ms', fallback=2000) / 1000,
+                                  self.config.getfloat('TAP', 'tolerance', fallback=0.25))
+
+        # Per stage latency histograms, enable with timing = yes in the [DEBUG] section
+        self.timing = Instrumentation(enabled=self.config.getboolean('DEBUG', 'timing', fallback=False))
+
+    def Read_LastSession_ini(self):
+        """Reading / creating lastsession.ini
+        """
+        try:
+            # if no config found, create one with default values
+            self.config.read(self.CONF_PATH)
+            if self.config.sections() == []:
+                self.config['OSC'] = {'IP': '127.000.000.001',
+                                      'PORT': 7000,
+                                      'RESYNC_BAR_ADRESS': '/composition/tempocontroller/resync',
+                                      'BPM_ADRESS': '/composition/tempocontroller/tempo'}
+                self.config['AUDIO'] = {'device_index': '1'}
+            if not self.config.has_section('STABILISER'):
+                self.config['STABILISER'] = {'window': '8', 'lock_threshold': '1.5', 'confirm': '2'}
+            if not self.config.has_section('SCHEDULER'):
+                # send ahead of the predicted beat, lead_ms compensates the measured pipeline latency
+                # bundles = yes sends tempo, beat position and resync as one bundle timetagged with the beat
+                # compensate_rtt = yes adds half the probed round trip time to the lead
+                # spin_ms is busy waited before every deadline (also tempo and MIDI clock), 0 on single core machines
+                self.config['SCHEDULER'] = {'enabled': 'no', 'lead_ms': '20', 'resync_on_downbeat': 'no',
+                                            'bundles': 'no', 'beat_adress': '/bpmtoosc/beat', 'compensate_rtt': 'no',
+                                            'spin_ms': '2'}
+            if not self.config.has_section('FEEDBACK'):
+                # tempo echoed by the receiver, we only resend when it differs from ours
+                self.config['FEEDBACK'] = {'enabled': 'no', 'ip': '0.0.0.0', 'port': '7002',
+                                           'adress': '/composition/tempocontroller/tempo', 'mapping': 'resolume',
+                                           'tolerance': '0.5', 'timeout_ms': '500', 'retries': '3'}
+            if not self.config.has_section('MIDI'):
+                # MIDI clock following the sent tempo, port is part of the output name
+                self.config['MIDI'] = {'enabled': 'no', 'port': '', 'virtual': 'no', 'ramp_ms': '200'}
+            if not self.config.has_section('TAP'):
+                # least-squares fit over the last window taps, taps further than tolerance beats off are ignored
+                # seed_detector = yes makes the live value start at the tapped tempo
+                self.config['TAP'] = {'window': '12', 'timeout_ms': '2000', 'tolerance': '0.25',
+                                      'seed_detector': 'no'}
+            if not self.config.has_section('CONTROL'):
+                # OSC remote control: <prefix>/tap, /resync, /sync, /plus, /minus, /double, /half
+                self.config['CONTROL'] = {'enabled': 'no', 'ip': '0.0.0.0', 'port': '7001', 'prefix': '/bpmtoosc'}
+            profiles.ensure_profiles(self.config)
+        except:
+            if self.retrys > 0:
+                self.retrys -= 1
+                print("Error reading config file. Deleting and creating new one.")
+                remove(self.CONF_PATH)
+                self.Read_LastSession_ini()
+
+    def Write_LastSession_ini(self):
+        """Save the config, creating the directory if it does not exist"""
+        self.CONF_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.CONF_PATH, 'w') as configfile:
+            self.config.write(configfile)
+
+    def start_stream(self, audio_device_index: int):
+        """Creates the OSC client and the audio analysis from the config\n
+        Args:
+            audio_device_index (int): pyaudio input device
+        """
+        import beatfinder
+        import osc_client
+
+        settings = self.config['STABILISER']
+        stabiliser = BpmStabiliser(settings.getint('window', 8), settings.getfloat('lock_threshold', 1.5),
+                                   settings.getint('confirm', 2))
+
+        # no lead time means sending right after the detection
+        settings = self.config['SCHEDULER']
+        lead = self._scheduler_lead() if settings.getboolean('enabled', False) else None
+        beat_address = settings.get('beat_adress', '/bpmtoosc/beat') if settings.getboolean('bundles', False) else None
+
+        # MIDI first: without rtmidi or the port there is simply no MIDI clock, nothing to clean up
+        midi = self.config['MIDI']
+        midi_port = None
+        if midi.getboolean('enabled', False):
+            import midi_clock
+
+            try:
+                midi_port = midi_clock.open_port(midi.get('port', ''), midi.getboolean('virtual', False))
+            except RuntimeError as e:
+                print(f"{e}, running without MIDI clock")
+
+        def open_detector(profile):
+            return beatfinder.BeatDetector(self.osc_client, audio_device_index, parent=self, timing=self.timing,
+                                           stabiliser=stabiliser, lead=lead,
+                                           resync_on_downbeat=settings.getboolean('resync_on_downbeat', False),
+                                           beat_address=beat_address, **profile)
+
+        try:
+            self.osc_client = osc_client.AsyncOSCTransport(osc_client.OSCFanout(self.build_targets()))
+            echo = self.config['FEEDBACK']
+            if echo.getboolean('enabled', False):
+                import feedback
+
+                self.osc_client = feedback.TempoFeedback(self.osc_client, self.config['OSC']['BPM_ADRESS'],
+                                                         echo.get('ip', '0.0.0.0'), echo.getint('port', 7002),
+                                                         echo.get('adress'), echo.get('mapping', 'resolume'),
+                                                         echo.getfloat('tolerance', 0.5),
+                                                         echo.getint('timeout_ms', 500) / 1000,
+                                                         echo.getint('retries', 3))
+            if midi_port is not None:
+                clock = midi_clock.MidiClock(midi_port, self.send_bpm, midi.getint('ramp_ms', 200) / 1000)
+                clock.start()
+                self.osc_client = midi_clock.ClockFollower(self.osc_client, clock, self.config['OSC']['BPM_ADRESS'],
+                                                           self.config['OSC']['RESYNC_BAR_ADRESS'])
+
+            profile = profiles.get_profile(self.config)
+            try:
+                self.beatfinder = open_detector(profile)
+            except OSError:
+                # e.g. a profile rate the interface does not offer: retry at the device's own rate
+                device_rate = beatfinder.default_samplerate(audio_device_index)
+                if device_rate in (None, profile['samplerate']):
+                    raise
+                print(f"Audio device rejected {profile['samplerate']} Hz, using {device_rate} Hz")
+                self.beatfinder = open_detector(dict(profile, samplerate=device_rate))
+        except Exception:
+            # e.g. a bad [TARGET] section, the feedback port in use or the audio device,
+            # do not leave the transport or the MIDI port open
+            if self.osc_client is not None:
+                self.osc_client.close()
+                self.osc_client = None
+            if midi_port is not None:
+                midi_port.close_port()
+            raise
+        self.running = True
+
+        # resume manual sending if sync was off when the stream got stopped
+        if not self.sync:
+            self._start_no_sync()
+
+    def stop_stream(self):
+        """Stops the audio analysis and deletes the worker instances"""
+        self.running = False
+
+        # no manual sends without an OSC client
+        self.tempo_clock.pause()
+
+        if self.beatfinder:
+            self.beatfinder.close()
+            self.osc_client.close()
+            print(f"Audio callback stats: {self.beatfinder.stats}")
+            print(self.beatfinder.stabiliser)
+            print(f"OSC targets: {self.osc_client.stats()}")
+            if hasattr(self.beatfinder.tempo, 'report'):
+                print(self.beatfinder.tempo.report())
+            if self.timing.enabled:
+                print(self.timing.dump())
+        del self.beatfinder
+        self.beatfinder = None
+        del self.osc_client
+        self.osc_client = None
+
+    def build_targets(self) -> list:
+        """OSC targets from the config\n
+        The [OSC] section is the main target, every enabled [TARGET:<name>] section adds one:
+            ip, port                            receiver
+            bpm_adress, resync_bar_adress       optional, default to the [OSC] addresses
+            mapping                             resolume (default), bpm or range
+            range_min, range_max                BPM range for the range mapping
+        Returns:
+            list: osc_client.OSCTarget
+        """
+        import osc_client
+
+        osc = self.config['OSC']
+        targets = [osc_client.OSCTarget("OSC", osc['IP'], int(osc['PORT']))]
+        for section in self.config.sections():
+            if not section.startswith('TARGET:'):
+                continue
+            settings = self.config[section]
+            if not settings.getboolean('enabled', True):
+                continue
+            addresses = {osc['BPM_ADRESS']: settings.get('bpm_adress', osc['BPM_ADRESS']),
+                         osc['RESYNC_BAR_ADRESS']: settings.get('resync_bar_adress', osc['RESYNC_BAR_ADRESS'])}
+            targets.append(osc_client.OSCTarget(section[len('TARGET:'):], settings['ip'], settings.getint('port'),
+                                                addresses, settings.get('mapping', 'resolume'),
+                                                (settings.getfloat('range_min', 20), settings.getfloat('range_max', 500))))
+        return targets
+
+    def update_targets(self) -> bool:
+        """Apply the targets of the config to the running stream\n
+        Returns:
+            bool: False if the config holds an invalid target, the old targets stay active then
+        """
+        if self.osc_client is None:
+            return False
+        try:
+            self.osc_client.set_targets(self.build_targets())
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Invalid OSC target, keeping the previous ones: {e}")
+            return False
+        return True
+
+    def _scheduler_lead(self) -> float:
+        settings = self.config['SCHEDULER']
+        lead = settings.getfloat('lead_ms', 20) / 1000
+        if settings.getboolean('compensate_rtt', False):
+            lead += self.network_latency
+        return lead
+
+    def set_network_latency(self, rtt: float):
+        """Round trip time to the target from the reachability probe\n
+        With compensate_rtt = yes in [SCHEDULER] half of it is added to the scheduler lead.
+        Args:
+            rtt (float): seconds, None if unknown
+        """
+        self.network_latency = rtt / 2 if rtt else 0.0
+        if self.beatfinder and self.beatfinder.scheduler is not None:
+            self.beatfinder.scheduler.lead = self._scheduler_lead()
+
+    def resync_bar(self):
+        """Restart the bar: beat LEDs, the no sync send timer and the receiving software"""
+        # reset bar animation
+        self.next_led(reset=True)
+        self.rate.reset()
+
+        # reset bpm timer, the next manual beat is now
+        self.tempo_clock.resync()
+
+        if self.beatfinder:
+            self.beatfinder.resync_bar()
+
+    def switch_sync(self, state: bool):
+        """Changes state of sync flag\n
+        Starts the tempo clock to emit "send bpm" when sync gets disabled
+
+        Args:
+            state (bool): State to switch to
+        """
+        #stop sync
+        if not state and self.sync:
+            self.sync = False
+            # hold what was sent last, the live tempo at the rate ratio
+            if self.live_bpm is not None:
+                self.send_bpm = self.rate.apply(self.live_bpm)
+            self.sync_changed(False)
+            if self.running:
+                self._start_no_sync()
+
+        #start sync
+        elif state and not self.sync:
+            self.tempo_clock.pause()
+            if self.beatfinder:
+                # the no sync thread may have sent something else meanwhile
+                self.beatfinder.stabiliser.force_send()
+            self.sync = True
+            self.sync_changed(True)
+        else:
+            print("Sync state already set to {}".format(state))
+
+    def set_rate(self, ratio):
+        """Change the rate ratio of the sent tempo while syncing\n
+        Args:
+            ratio (int | float | str | Fraction): e.g. "1/2" for half time or "3/2" for a triplet feel
+        """
+        self.rate.set(ratio)
+        if self.beatfinder:
+            self.beatfinder.rate_changed()
+        self.rate_changed(self.rate.ratio)
+        self.effective_rate_changed(self.rate.effective)
+
+    def follow_rate(self, bpm):
+        """Called by the BeatDetector with every detected tempo before gating its beats\n
+        At a tempo the ratio would send outside the receiver's range, the ratio is folded by octaves,
+        and the beat LEDs, the bar and the GUI follow the folded one.
+        """
+        if self.rate.follow(bpm):
+            if self.beatfinder:
+                self.beatfinder.rate_changed()
+            print(f"Rate {self.rate} at {bpm} BPM")
+            self.effective_rate_changed(self.rate.effective)
+
+    def nudge(self, delta: int):
+        """Switch sync off and change the send bpm by delta"""
+        self.set_rate(1)
+        if self.sync:
+            self.switch_sync(False)
+        if 20 <= self.send_bpm + delta <= 499:
+            self.send_bpm += delta
+            self.update_bpm_display(self.send_bpm, send_to="send")
+
+    def scale_send_bpm(self, factor: float):
+        """Switch sync off and multiply the send bpm, e.g. 2 or 0.5"""
+        self.set_rate(1)
+        if self.sync:
+            self.switch_sync(False)
+        if 20 <= self.send_bpm * factor <= 500:
+            self.send_bpm = round(self.send_bpm * factor, 2)
+            self.update_bpm_display(self.send_bpm, send_to="send")
+
+    def tap(self, timestamp: float = None):
+        """Feed a tap to the tap tempo and send the tapped bpm\n
+        Args:
+            timestamp (float, optional): perf_counter() time of the tap, e.g. when the control packet arrived
+        """
+        bpm = self.tap_tempo.tap(timestamp)
+        if bpm is None:
+            # not enough taps yet
+            return
+
+        # disable sync if it was enabled
+        # this also starts the osc sending thread
+        if self.sync:
+            self.switch_sync(False)
+
+        # set variable for the tempo clock and display it
+        self.send_bpm = round(bpm)
+        self.update_bpm_display(self.send_bpm, send_to="send")
+        if self.beatfinder is not None and self.config.getboolean('TAP', 'seed_detector', fallback=False):
+            # the stabiliser works on the detected tempo, the tap is in the sent one
+            self.beatfinder.stabiliser.seed(bpm / self.rate.effective)
+
+    def start_control_server(self):
+        """Listen for OSC remote control if enabled in the [CONTROL] section"""
+        settings = self.config['CONTROL']
+        if self.control_server is None and settings.getboolean('enabled', False):
+            import control
+
+            try:
+                self.control_server = control.OSCControlServer(self, settings.get('ip', '0.0.0.0'),
+                                                               settings.getint('port', 7001),
+                                                               settings.get('prefix', '/bpmtoosc'))
+            except (OSError, ValueError) as e:
+                # e.g. a wrong ip or a port in use, carry on without
+                print(f"Invalid OSC control address, remote control disabled: {e}")
+
+    def stop_control_server(self):
+        if self.control_server is not None:
+            self.control_server.close()
+            self.control_server = None
+
+    def sync_changed(self, state: bool):
+        """Hook: sync was switched on or off"""
+
+    def rate_changed(self, ratio):
+        """Hook: rate ratio was changed, ratio is a Fraction"""
+
+    def effective_rate_changed(self, effective):
+        """Hook: the ratio actually sent changed, a Fraction that differs from rate.ratio while folded"""
+
+    def update_bpm_display(self, bpm, send_to: str = "both", Blink=False):
+        """Hook: show a bpm value, see Main_Frame.update_bpm_display"""
+
+    def next_led(self, reset=False, thread=True):
+        """Hook: advance the beat LEDs, see Main_Frame.next_led"""
+
+    @property
+    def send_bpm(self):
+        return self._send_bpm
+
+    @send_bpm.setter
+    def send_bpm(self, bpm):
+        # the tempo clock follows right away, keeping its phase
+        self._send_bpm = bpm
+        if bpm != self.tempo_clock.bpm:
+            self.tempo_clock.set_bpm(bpm)
+
+    def _start_no_sync(self):
+        """Start sending the send bpm on the tempo clock, with a beat now"""
+        # the receiver has it already, switch_sync applied the rate ratio
+        self._no_sync_sent = self.send_bpm
+        self.tempo_clock.start()
+
+    def _no_sync_beat(self, beat: int):
+        """Tempo clock tick while sync is disabled\n
+        Sends the bpm showed in send display if it changed, an old live value or a tapped in one.
+        """
+        self.next_led(thread=False)
+        # read once, stop_stream may clear them from another thread meanwhile
+        client, bpm = self.osc_client, self.send_bpm
+        if self._no_sync_sent != bpm and client is not None:
+            client.send_osc(self.config['OSC']['BPM_ADRESS'], bpm, map_to_resolume=True)
+            self.update_bpm_display(bpm, send_to="send", Blink=True) # send bpm to send display
+            self._no_sync_sent = bpm
@@ -70,11 +70,20 @@ _elms = ["A", "B", "C", "D", "E", "F", "G", "Dot", "Colon"]
 #-------------------------------------------------------------------------------
 
 class SevenSegmentDisp(wx.Panel):
+    # Painting blits a bitmap of the whole glyph. Glyphs are rendered once per
+    # value / dot / colon state for the current size and geometry, for up to
+    # max_schemes colour schemes (the blinking displays alternate between two).
+    # The paint time with and without the cache has not been measured yet,
+    # see benchmark_paint; cache_glyphs = False draws the paths as before.
+    cache_glyphs = True
+    max_schemes  = 4
+
     def __init__(self, parent):
         wx.Panel.__init__(self, parent, -1)
         self.parent = parent
         self.drawing_params = None
         self.mysize = self.GetSize()
+        self._glyphs = {}
 
         self.SetValue("8.:")
 
@@ -115,6 +124,7 @@ class SevenSegmentDisp(wx.Panel):
         dc = wx.MemoryDC(self._buffer)
         gc = wx.GCDC(dc)
         self.Calc(gc)
+        self.InvalidateGlyphs()
 
 
     def Calc(self, dc):
@@ -136,7 +146,7 @@ class SevenSegmentDisp(wx.Panel):
         path.Transform(m)
         m1 = m
 
-        sw, sh = self.GetSize()
+        sw, sh = self.GetCellSize()
         xm, ym = self.margin
         sw = sw-xm*2; sh = sh-ym*2
         bx, by, bw, bh = path.GetBox()
@@ -163,9 +173,59 @@ class SevenSegmentDisp(wx.Panel):
 
 
     def OnPaint(self, evt):
-        dc = wx.BufferedPaintDC(self, self._buffer)
+        if self.cache_glyphs:
+            dc = wx.PaintDC(self)
+            dc.DrawBitmap(self.GetGlyph(), 0, 0)
+        else:
+            dc = wx.BufferedPaintDC(self, self._buffer)
+            gc = wx.GCDC(dc)
+            self.Draw(gc)
+
+
+    def InvalidateGlyphs(self):
+        # Drops all rendered glyphs, needed whenever size, geometry,
+        # tilt or the dot / colon setup change.
+        self._glyphs = {}
+
+
+    def GetScheme(self):
+        c = self.colours
+        return tuple(wx.Colour(colour).Get() for colour in
+                     (c.background, c.pen_seg_on, c.brush_seg_on,
+                      c.pen_seg_off, c.brush_seg_off))
+
+
+    def GetCellSize(self):
+        # Area one glyph is fitted into, the whole panel here.
+        return self.GetSize()
+
+
+    def GetGlyph(self, elements=None):
+        scheme = self.GetScheme()
+        glyphs = self._glyphs.get(scheme)
+        if glyphs is None:
+            glyphs = self._glyphs[scheme] = {}
+            # oldest scheme goes first
+            while len(self._glyphs) > self.max_schemes:
+                del self._glyphs[next(iter(self._glyphs))]
+
+        value, dot, colon = elements or self.GetElements()
+        key = (value if value in _opts else " ", dot, colon)
+        bmp = glyphs.get(key)
+        if bmp is None:
+            bmp = glyphs[key] = self.RenderGlyph(key)
+        return bmp
+
+
+    def RenderGlyph(self, elements):
+        sz = self.GetCellSize()
+        bmp = wx.Bitmap(max(1, sz.width), max(1, sz.height), 32)
+        dc = wx.MemoryDC(bmp)
         gc = wx.GCDC(dc)
-        self.Draw(gc)
+        self.Draw(gc, elements)
+        del gc
+        dc.SelectObject(wx.NullBitmap)
+        return bmp
 
 
     def GetElements(self):
@@ -183,7 +243,7 @@ class SevenSegmentDisp(wx.Panel):
         return value, dot, colon
 
 
-    def Draw(self, dc):
+    def Draw(self, dc, elements=None):
         dc.SetBackground(wx.Brush(self.colours.background))
         dc.Clear()
         dc.SetAxisOrientation(True, False)
@@ -194,7 +254,7 @@ class SevenSegmentDisp(wx.Panel):
         path_on  = gc.CreatePath()
         path_off = gc.CreatePath()
 
-        value, dot, colon = self.GetElements()
+        value, dot, colon = elements or self.GetElements()
 
         segments = _opts.get(value, _opts[" "])
         for i in range(0, 7):
@@ -428,7 +488,7 @@ class SevenSegmentDisp(wx.Panel):
 
     def SetTilt(self, value):
         self.tilt = value
-        self.InitBuffer()
+        self.InitBuffer()  # also drops the rendered glyphs
         self.Refresh()
 
 
@@ -441,6 +501,16 @@ class SevenSegmentDisp(wx.Panel):
         # values: wx.Colour or (colour) valid 3 or 4-tuple.
         # e.g: SetColours(segment_on=(255, 0, 0), background=wx.BLACK)
 
+        self.UpdateColours(**kwargs)
+
+        # no need to drop the glyphs, they are kept per colour scheme and
+        # GetGlyph picks (or renders) the ones of the new scheme
+        self.Refresh()
+
+
+    def UpdateColours(self, **kwargs):
+        # Same as SetColours, without refreshing.
+
         if "background" in kwargs.keys():
             self.colours.background = kwargs["background"]
 
@@ -452,8 +522,6 @@ class SevenSegmentDisp(wx.Panel):
             self.colours.pen_seg_off = kwargs["segment_off"]
             self.colours.brush_seg_off = kwargs["segment_off"]
 
-        self.Refresh()
-
 
     def GetColours(self):
         return {"background":  self.colours.background,
@@ -479,7 +547,7 @@ class SevenSegmentDisp(wx.Panel):
         if "separation" in kwargs.keys():
             self.sep = kwargs["separation"]
 
-        self.InitBuffer()
+        self.InitBuffer()  # also drops the rendered glyphs
         self.Refresh()
 
 
@@ -554,6 +622,44 @@ class myFrame(wx.Frame):
 
 #-------------------------------------------------------------------------------
 
+def benchmark_paint(frames=300):
+    # Average time to repaint six digits per frame, the way the BPM
+    # displays update on a beat, with and without the glyph cache.
+    import time
+
+    app = wx.App(False)
+    frame = wx.Frame(None, -1, size=(400, 150))
+    sizer = wx.BoxSizer(wx.HORIZONTAL)
+    disps = []
+    for i in range(0, 6):
+        t = SevenSegmentDisp(frame)
+        sizer.Add(t, 1, flag=wx.EXPAND)
+        disps.append(t)
+    frame.SetSizer(sizer)
+    frame.Show(True)
+    frame.Layout()
+    wx.Yield()
+
+    schemes = ({"background": (240, 240, 240), "segment_off": (220, 220, 220)},
+               {"background": (220, 220, 220), "segment_off": (240, 240, 240)})
+    result = {}
+    for cached in (False, True):
+        SevenSegmentDisp.cache_glyphs = cached
+        start = time.perf_counter()
+        for n in range(frames):
+            for i, d in enumerate(disps):
+                d.SetColours(**schemes[n % 2])
+                d.SetValue(str((n + i) % 10))
+                d.Update()  # paint now
+        ms = (time.perf_counter() - start) / frames * 1000
+        result["glyph cache" if cached else "paths"] = round(ms, 3)
+
+    frame.Destroy()
+    app.Destroy()
+    return result
+
+#-------------------------------------------------------------------------------
+
 class myApp(wx.App):
     def OnInit(self):
         frame = myFrame(None)
@@ -563,9 +669,13 @@ class myApp(wx.App):
 #-------------------------------------------------------------------------------
 
 if __name__ == '__main__':
-    import time
-    app = myApp(0)
-    app.MainLoop()
+    import sys, time
+    if "--bench" in sys.argv:
+        # ms per frame of six digits
+        print(benchmark_paint())
+    else:
+        app = myApp(0)
+        app.MainLoop()
 
 
 #
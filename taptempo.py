@@ -0,0 +1,239 @@
+"""Tap tempo estimation
+
+TapTempo fits a line through the last taps (tap time over beat number) by
+least squares. The sums of the fit are updated when a tap enters or leaves
+the fixed size window, so every tap costs the same no matter how long the
+user keeps tapping. A tap that does not land on (or one beat after) the
+predicted beat is rejected as mistimed; two rejections in a row mean the
+tempo really changed and the fit starts over from those taps. The same
+happens when two intervals in a row agree with each other but not with the
+fit, which is how half or double time gets re-tapped. A tap at or before the
+previous one (a bounce, or two taps in one control packet) is ignored. Times
+come from the monotonic perf_counter clock.
+
+Usage:
+    python taptempo.py    # error of TapTempo versus the old mean of all intervals, also on half / double time
+"""
+from collections import deque
+from time import perf_counter
+
+
+class TapTempo:
+    """Least-squares tempo over a sliding window of taps"""
+
+    def __init__(self, window: int = 12, timeout: float = 2.0, tolerance: float = 0.25, clock=perf_counter):
+        """
+        Args:
+            window (int): taps in the fit
+            timeout (float): seconds without a tap after which tapping starts over
+            tolerance (float): allowed distance of a tap from the predicted beat, in beats
+            clock (callable): monotonic time in seconds, used for taps without a timestamp
+        """
+        self.window = max(2, window)
+        self.timeout = timeout
+        self.tolerance = tolerance
+        self.clock = clock
+
+        self._taps = deque()  # (beat number, time since the origin) in the fit
+        self._origin = None  # time of the first tap, keeps the sums small
+        self._n = self._sk = self._st = self._skk = self._skt = 0
+        self._last = None  # (beat number, time) of the last accepted tap
+        self._rejected = []  # times of consecutive rejected taps
+        self._recent = deque(maxlen=3)  # times of the last taps, accepted or not
+
+        self.bpm = None  # None until three taps agree
+        self.accepted = 0
+        self.rejected = 0
+
+    @property
+    def period(self) -> float:
+        """Seconds per beat of the fit, None with less than two taps"""
+        if self._n < 2:
+            return None
+        denominator = self._n * self._skk - self._sk * self._sk
+        return (self._n * self._skt - self._sk * self._st) / denominator
+
+    def reset(self):
+        self._taps.clear()
+        self._origin = self._last = None
+        self._n = self._sk = self._st = self._skk = self._skt = 0
+        self._rejected = []
+        self._recent.clear()
+        self.bpm = None
+
+    def tap(self, timestamp: float = None) -> float:
+        """Add a tap\n
+        Args:
+            timestamp (float, optional): clock() time of the tap, e.g. when the control packet arrived
+        Returns:
+            float: the tempo, None while there are not enough taps
+        """
+        now = self.clock() if timestamp is None else timestamp
+        if self._last is None or now - self._origin - self._last[1] > self.timeout:
+            self.reset()
+            self._origin = now
+            self._recent.append(now)
+            self._add(0, 0.0)
+            return None
+
+        if now <= self._recent[-1]:
+            # a bounce, or several taps in one control packet: no interval to learn from
+            return self.bpm
+
+        self._recent.append(now)
+        t = now - self._origin
+        period = self.period
+        if self._n >= 3 and len(self._recent) == 3 and period > 0:
+            first, second, third = self._recent
+            before, interval = second - first, third - second
+            if (abs(interval / before - 1) <= self.tolerance and abs(before / period - 1) > self.tolerance
+                    and abs(interval / period - 1) > self.tolerance):
+                # two intervals agree with each other but not with the fit, e.g. half or double time:
+                # start over from these taps
+                self.reset()
+                self._origin = first
+                for k, tap in enumerate((first, second, third)):
+                    self._recent.append(tap)
+                    self._add(k, tap - first)
+                self.bpm = 60.0 / self.period
+                return self.bpm
+
+        if period is None:
+            # second tap, nothing to compare with yet
+            self._add(1, t)
+        else:
+            beats = (t - self._last[1]) / period
+            step = round(beats)
+            # one interval is too rough a prediction, the third tap only has to come after about a period
+            if self._n < 3 and step == 1 or step in (1, 2) and abs(beats - step) <= self.tolerance:
+                # on the next beat or the one after (a missed tap)
+                self._rejected = []
+                self._add(self._last[0] + step, t)
+            else:
+                self.rejected += 1
+                self._rejected.append(now)
+                if len(self._rejected) < 2:
+                    return self.bpm
+                # twice off the grid, tapping a new tempo: start over from the rejected taps
+                first, second = self._rejected[-2:]
+                self.reset()
+                self._origin = first
+                self._recent.extend((first, second))
+                self._add(0, 0.0)
+                self._add(1, second - first)
+                return None
+
+        if self._n >= 3:
+            self.bpm = 60.0 / self.period
+        return self.bpm
+
+    def _add(self, k: int, t: float):
+        if len(self._taps) == self.window:
+            old_k, old_t = self._taps.popleft()
+            self._update(-1, old_k, old_t)
+        self._taps.append((k, t))
+        self._update(1, k, t)
+        self._last = (k, t)
+        self.accepted += 1
+
+    def _update(self, sign: int, k: int, t: float):
+        self._n += sign
+        self._sk += sign * k
+        self._st += sign * t
+        self._skk += sign * k * k
+        self._skt += sign * k * t
+
+
+def benchmark(taps: int = 32, bpm: float = 128.0, change: float = 4.0, jitter: float = 0.015, runs: int = 200,
+              seed: int = 0) -> dict:
+    """Error of the shown tempo while tapping with human jitter\n
+    Each run taps bpm with one tap far too early in the middle, then goes on without a pause
+    at bpm + change for another taps taps.
+
+    Args:
+        taps (int): taps per tempo
+        bpm (float): first tempo
+        change (float): tempo change after taps taps
+        jitter (float): standard deviation of a tap in seconds
+        runs (int): runs averaged
+        seed (int): random seed
+    Returns:
+        dict: mean absolute BPM error of the shown values (from the third tap on), of the value shown
+            after the mistimed tap and of the last 8 values after the change, for TapTempo and for
+            the old mean over all intervals
+    """
+    import random
+
+    rng = random.Random(seed)
+    errors = {name: {"steady_bpm": [], "mistimed_tap_bpm": [], "after_change_bpm": []}
+              for name in ("tap_tempo", "mean_interval")}
+    for _ in range(runs):
+        period = 60.0 / bpm
+        times = [i * period for i in range(taps)]
+        # one tap hit far too early
+        times[taps // 2] -= period * 0.4
+        period = 60.0 / (bpm + change)
+        times += [times[-1] + (i + 1) * period for i in range(taps)]
+        times = [t + rng.gauss(0, jitter) for t in times]
+
+        tempo = TapTempo(clock=lambda: 0.0)
+        for i, t in enumerate(times):
+            shown = {"tap_tempo": tempo.tap(t), "mean_interval": 60.0 * i / (t - times[0]) if i else None}
+            for name, value in shown.items():
+                if i < 2 or value is None:
+                    continue
+                if i < taps:
+                    errors[name]["steady_bpm"].append(abs(value - bpm))
+                    if i == taps // 2:
+                        errors[name]["mistimed_tap_bpm"].append(abs(value - bpm))
+                elif i >= len(times) - 8:
+                    errors[name]["after_change_bpm"].append(abs(value - bpm - change))
+    return {name: {metric: round(sum(values) / len(values), 3) for metric, values in metrics.items()}
+            for name, metrics in errors.items()}
+
+
+def benchmark_retap(bpm: float = 120.0, taps: int = 16, jitter: float = 0.01, runs: int = 200,
+                    seed: int = 0) -> dict:
+    """Taps needed to follow a switch to double or half time without a pause\n
+    Args:
+        bpm (float): first tempo, tapped 8 times
+        taps (int): taps at the new tempo
+        jitter (float): standard deviation of a tap in seconds
+        runs (int): runs averaged
+        seed (int): random seed
+    Returns:
+        dict: per factor the mean number of taps at the new tempo until the shown value is within 2%
+            of it and stays there (None if never), for TapTempo and for the old mean over all intervals
+    """
+    import random
+
+    rng = random.Random(seed)
+    result = {}
+    for factor in (2.0, 0.5):
+        counts = {"tap_tempo": [], "mean_interval": []}
+        for _ in range(runs):
+            times = [i * 60.0 / bpm for i in range(8)]
+            times += [times[-1] + (i + 1) * 60.0 / (bpm * factor) for i in range(taps)]
+            times = [t + rng.gauss(0, jitter) for t in times]
+
+            tempo = TapTempo(clock=lambda: 0.0)
+            shown = {"tap_tempo": [], "mean_interval": []}
+            for i, t in enumerate(times):
+                shown["tap_tempo"].append(tempo.tap(t))
+                shown["mean_interval"].append(60.0 * i / (t - times[0]) if i else None)
+            for name, values in shown.items():
+                settled = None
+                for i, value in enumerate(values[8:]):
+                    if value is None or abs(value / (bpm * factor) - 1) > 0.02:
+                        settled = None
+                    elif settled is None:
+                        settled = i + 1
+                counts[name].append(settled)
+        result[f"x{factor:g}"] = {name: None if None in values else round(sum(values) / len(values), 2)
+                                  for name, values in counts.items()}
+    return result
+
+
+if __name__ == "__main__":
+    print(benchmark())
+    print(benchmark_retap())
@@ -0,0 +1,210 @@
+"""Drift free tempo clock for the manual (no sync) send path
+
+TempoClock calls a function on every beat of a tempo from one long lived
+thread. Beat n is due at anchor + n * period on the monotonic clock, so a
+late wake up never shifts the following beats. Tempo and phase can change
+while it runs: a tempo change keeps the last beat as the new anchor, resync
+starts the bar now, and pause / start do not tear the thread down.
+
+Clock and wait function are injectable, drift_benchmark uses that to run
+hours of beats against a fake clock in a fraction of a second.
+
+Usage:
+    python tempoclock.py    # long run drift of TempoClock versus the old relative wait loop
+"""
+from threading import Thread, Event, Lock
+from time import perf_counter
+
+from deadline import clearing_wait, wait_until, missed
+from instrumentation import LatencyHistogram
+
+
+class TempoClock:
+    """Calls tick(beat) on absolute beat deadlines"""
+
+    def __init__(self, tick, bpm: float = 120.0, clock=perf_counter, wait=None, spin: float = None,
+                 thread: bool = True):
+        """
+        Args:
+            tick (callable): tick(beat), beat counts from 0 at start / resync
+            bpm (float): initial tempo
+            clock (callable): monotonic time in seconds
+            wait (callable, optional): wait(timeout) -> True if woken early, default an Event.wait
+            spin (float, optional): seconds to busy wait before a deadline, default deadline.SPIN, 0 with a fake clock
+            thread (bool): run on an own thread, False to drive it with step()
+        """
+        self.tick = tick
+        self.clock = clock
+        self.spin = spin
+        self._wake = Event()
+        self._wait = wait or clearing_wait(self._wake)
+        self._lock = Lock()
+
+        self._period = 60.0 / bpm
+        self._anchor = None  # time of a beat on the grid
+        self._n = 0  # beats from the anchor to the next deadline
+        self.beat = 0  # beats since start / resync
+        self.running = False
+
+        self.fired = 0
+        self.lateness = LatencyHistogram()  # tick call after its deadline
+
+        self._active = True
+        self._thread = None
+        if thread:
+            self._thread = Thread(target=self._run, name="TempoClock", daemon=True)
+            self._thread.start()
+
+    @property
+    def bpm(self) -> float:
+        return 60.0 / self._period
+
+    @property
+    def next_deadline(self) -> float:
+        """Time of the next beat, None while paused"""
+        with self._lock:
+            return self._anchor + self._n * self._period if self.running else None
+
+    def set_bpm(self, bpm: float):
+        """Change the tempo from the last beat on"""
+        with self._lock:
+            if self._anchor is not None and self._n > 0:
+                self._anchor += (self._n - 1) * self._period
+                self._n = 1
+            self._period = 60.0 / bpm
+        self._wake.set()
+
+    def shift(self, seconds: float):
+        """Move the beat grid, positive is later"""
+        with self._lock:
+            if self._anchor is not None:
+                self._anchor += seconds
+        self._wake.set()
+
+    def resync(self):
+        """Next beat now, counted as beat 0"""
+        with self._lock:
+            self._anchor = self.clock()
+            self._n = 0
+            self.beat = 0
+        self._wake.set()
+
+    def start(self):
+        """Start ticking with a beat now"""
+        self.running = True
+        self.resync()
+
+    def pause(self):
+        self.running = False
+        self._wake.set()
+
+    def step(self):
+        """Wait for the next beat and tick, the body of the clock thread"""
+        if not self.running:
+            self._wait(0.5)
+            return
+
+        deadline = self.next_deadline
+        if deadline is None:
+            # paused meanwhile
+            return
+        if not wait_until(deadline, self._wait, self.spin, self.clock):
+            # tempo, phase or state changed meanwhile
+            return
+
+        with self._lock:
+            if not self.running or deadline != self._anchor + self._n * self._period:
+                return
+            late = self.clock() - deadline
+            # after a stall of more than a beat, continue on the grid instead of catching up
+            self._n += missed(late, self._period) + 1
+            beat = self.beat
+            self.beat += 1
+        self.fired += 1
+        self.lateness.record(late)
+        try:
+            self.tick(beat)
+        except Exception as e:
+            # the one clock thread has to survive a failing callback
+            print(f"TempoClock tick failed: {e}")
+
+    def _run(self):
+        while self._active:
+            self.step()
+
+    def close(self):
+        self._active = False
+        self.running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class FakeClock:
+    """Simulated time for TempoClock: wait() advances it and oversleeps like a real OS"""
+
+    def __init__(self, oversleep: float = 0.0005, seed: int = 0):
+        """
+        Args:
+            oversleep (float): mean extra time a wait takes, uniformly distributed 0..2x
+            seed (int): random seed
+        """
+        import random
+
+        self.now = 0.0
+        self.oversleep = oversleep
+        self._rng = random.Random(seed)
+
+    def __call__(self) -> float:
+        return self.now
+
+    def wait(self, timeout: float) -> bool:
+        self.now += max(0.0, timeout) + self._rng.uniform(0, 2 * self.oversleep)
+        return False
+
+
+def drift_benchmark(beats: int = 100000, bpm: float = 128.0, oversleep: float = 0.0005,
+                    work: float = 0.0001) -> dict:
+    """Beat time error after a long run, TempoClock against the old relative wait loop\n
+    Args:
+        beats (int): beats to simulate, 100000 at 128 BPM are about 13 hours
+        bpm (float): tempo
+        oversleep (float): mean extra time each wait takes
+        work (float): time spent in each tick
+    Returns:
+        dict: hours simulated, final drift and largest error of a beat in ms per implementation
+    """
+    period = 60.0 / bpm
+
+    def errors(times):
+        error = [t - (times[0] + i * period) for i, t in enumerate(times)]
+        return {"drift_ms": round(error[-1] * 1000, 3), "max_error_ms": round(max(map(abs, error)) * 1000, 3)}
+
+    # TempoClock
+    fake = FakeClock(oversleep)
+    times = []
+
+    def tick(beat):
+        times.append(fake.now)
+        fake.now += work
+
+    clock = TempoClock(tick, bpm, clock=fake, wait=fake.wait, spin=0, thread=False)
+    clock.start()
+    while len(times) < beats:
+        clock.step()
+    result = {"hours": round(beats * period / 3600, 2), "tempo_clock": errors(times)}
+
+    # the old send_thread_when_no_sync loop: wait(60 / bpm - (time() - prev_time))
+    fake = FakeClock(oversleep)
+    times = []
+    while len(times) < beats:
+        prev_time = fake.now
+        times.append(fake.now)
+        fake.now += work
+        fake.wait(period - (fake.now - prev_time))
+    result["relative_wait"] = errors(times)
+    return result
+
+
+if __name__ == "__main__":
+    print(drift_benchmark())
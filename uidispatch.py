@@ -0,0 +1,86 @@
+"""Single update channel from worker threads to the display widgets
+
+The beat detector, tempo clock and control server post the newest display
+state (live / send BPM, blink phase, lit beat LED) into one coalescing slot.
+Only the first post after an update schedules a flush on the GUI thread via
+wx.CallAfter, so no threads are created and the widgets are only touched by
+the GUI thread. Flushes are capped to a frame rate; posts arriving meanwhile
+simply overwrite the slot and stale intermediate states are never drawn.
+"""
+from threading import Lock
+from time import perf_counter
+
+import wx
+
+DISPLAYS = ("live", "send")
+
+
+class DisplayState:
+    """What the displays should show"""
+
+    def __init__(self):
+        self.values = {"live": "---", "send": "---"}  # bpm or text per display
+        self.blinks = {"live": 0, "send": 0}  # background toggles per display, the phase is the parity
+        self.led = 3  # lit beat LED, the first beat lights LED 0
+
+    def copy(self) -> "DisplayState":
+        state = DisplayState()
+        state.values = dict(self.values)
+        state.blinks = dict(self.blinks)
+        state.led = self.led
+        return state
+
+
+class UiDispatcher:
+    """Coalescing slot flushed on the GUI thread at a capped frame rate"""
+
+    def __init__(self, apply, fps: float = 60.0):
+        """
+        Args:
+            apply (callable): apply(DisplayState), called on the GUI thread
+            fps (float): maximum flushes per second
+        """
+        self.apply = apply
+        self.interval = 1.0 / fps
+        self._state = DisplayState()
+        self._lock = Lock()
+        self._scheduled = False
+        self._last_flush = 0.0
+
+        self.posted = 0
+        self.flushed = 0  # posted - flushed updates were coalesced
+
+    def post_bpm(self, bpm, send_to: str = "both", blink: bool = False):
+        """Show bpm on the live, send or both displays (any thread)"""
+        with self._lock:
+            for display in (DISPLAYS if send_to == "both" else (send_to,)):
+                self._state.values[display] = bpm
+                if blink:
+                    self._state.blinks[display] += 1
+            self._schedule()
+
+    def post_led(self, reset: bool = False):
+        """Light the next beat LED, or the first one on reset (any thread)"""
+        with self._lock:
+            self._state.led = 0 if reset else (self._state.led + 1) % 4
+            self._schedule()
+
+    def _schedule(self):
+        # lock held
+        self.posted += 1
+        if not self._scheduled:
+            self._scheduled = True
+            wx.CallAfter(self._flush)
+
+    def _flush(self):
+        wait = self._last_flush + self.interval - perf_counter()
+        if wait > 0:
+            # frame rate cap, whatever gets posted until then is included
+            wx.CallLater(max(1, int(wait * 1000)), self._flush)
+            return
+        with self._lock:
+            state = self._state.copy()
+            self._scheduled = False
+        self._last_flush = perf_counter()
+        self.flushed += 1
+        self.apply(state)